@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import subprocess
+from importlib import import_module
+
+try:
+    from snakepit import settings
+    from snakepit.utils import validate_settings
+    from snakepit.robot_snake import RobotSnake
+except ImportError:
+    print('snakepit Python package not found', file=sys.stderr)
+    sys.exit(64)
+
+
+ROBOT_CLASSES_DEFAULT = ['snakepit.robot_snake.RandomRobotSnake', 'snakepit.robot_snake.WallGrinderRobotSnake']
+
+
+def int_list(value):
+    try:
+        return [int(i) for i in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid list of numbers: "%s"' % value)
+
+
+def field_size_list(value):
+    try:
+        return [tuple(int(i) for i in size.lower().split('x', 1)) for size in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid list of field sizes (e.g. 40x40,80x60): "%s"' % value)
+
+
+def robot_class(value):
+    if '.' not in value:
+        raise argparse.ArgumentTypeError('Invalid robot class path: "%s"' % value)
+
+    module_name, class_name = value.rsplit('.', 1)
+    class_ = getattr(import_module(module_name), class_name, None)
+
+    if not (isinstance(class_, type) and issubclass(class_, RobotSnake)):
+        raise argparse.ArgumentTypeError('Robot class "%s" does not inherit from RobotSnake' % value)
+
+    return class_
+
+
+def run_worker(args):
+    # Runs all player counts for the field size configured via SNAKEPIT_FIELD_SIZE_X and SNAKEPIT_FIELD_SIZE_Y
+    from snakepit.simulation import Simulation
+
+    logging.getLogger('snakepit').setLevel(logging.ERROR)
+    robot_classes = args.robots or [robot_class(i) for i in ROBOT_CLASSES_DEFAULT]
+    results = []
+
+    for players in args.players:
+        classes = [robot_classes[i % len(robot_classes)] for i in range(players)]
+        simulation = Simulation(classes, protocol=args.protocol)
+        stats = asyncio.get_event_loop().run_until_complete(simulation.run(args.frames))
+        stats['field_size'] = '%dx%d' % (settings.FIELD_SIZE_X, settings.FIELD_SIZE_Y)
+        results.append(stats)
+
+    print(json.dumps(results))
+
+
+def run_benchmark(args):
+    # The world size is a class attribute loaded from settings -> run each field size in a separate process
+    results = []
+
+    for size_x, size_y in args.field_sizes:
+        env = dict(os.environ, SNAKEPIT_FIELD_SIZE_X=str(size_x), SNAKEPIT_FIELD_SIZE_Y=str(size_y),
+                   SNAKEPIT_MAX_PLAYERS=str(max(args.players)))
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker'] + sys.argv[1:]
+        output = subprocess.check_output(cmd, env=env)
+        results.extend(json.loads(output.decode('utf-8')))
+
+    print('{:>10} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'field', 'players', 'frames', 'fps', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'robot ms'))
+
+    for r in results:
+        print('{:>10} {:>8} {:>8} {:>10.1f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            r['field_size'], r['players'], r['frames'], r['fps'], r['frame_p50'] * 1000, r['frame_p90'] * 1000,
+            r['frame_p99'] * 1000, r['frame_max'] * 1000, r['robot_mean'] * 1000))
+
+
+parser = argparse.ArgumentParser(description='Measure the raw game engine throughput by running headless games '
+                                             'with in-process robot players.')
+parser.add_argument('--players', dest='players', metavar='N[,N...]', type=int_list, default=[1, 2, 4, 6],
+                    help='comma separated numbers of players (default: 1,2,4,6)')
+parser.add_argument('--field-size', dest='field_sizes', metavar='XxY[,XxY...]', type=field_size_list,
+                    default=[(settings.FIELD_SIZE_X, settings.FIELD_SIZE_Y)],
+                    help='comma separated field sizes (default: {}x{})'.format(settings.FIELD_SIZE_X,
+                                                                               settings.FIELD_SIZE_Y))
+parser.add_argument('--frames', dest='frames', metavar='N', type=int, default=1000,
+                    help='number of frames to render for each configuration (default: 1000)')
+parser.add_argument('--robot', dest='robots', metavar='CLASS', type=robot_class, action='append',
+                    help='robot snake class; can be used multiple times (default: {})'.format(
+                        ', '.join(ROBOT_CLASSES_DEFAULT)))
+parser.add_argument('--protocol', dest='protocol', choices=('json', 'binary'), default='json',
+                    help='encoding used for the broadcast messages (default: json)')
+parser.add_argument('--worker', dest='worker', action='store_true', help=argparse.SUPPRESS)
+
+args = parser.parse_args()
+
+if args.worker:
+    validate_settings(settings)
+    run_worker(args)
+else:
+    run_benchmark(args)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import sys
+import json
+import asyncio
+import logging
+import argparse
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    from snakepit.messaging import Messaging
+    from snakepit.robot_player import DEFAULT_SERVER_URL
+    from snakepit.load_test import LoadTest
+except ImportError:
+    print('snakepit Python package not found', file=sys.stderr)
+    sys.exit(64)
+
+
+def raise_open_files_limit():
+    # every client needs one socket
+    if resource:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def print_stats(stats):
+    print('clients: {clients}, connected: {connected}, errors: {errors}, frames: {frames}, '
+          'frames received: {frames_received}, keys sent: {keys_sent}, '
+          'bytes received: {bytes_received}'.format(**stats))
+    print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format('ms', 'p50', 'p90', 'p99', 'max'))
+
+    for name in ('connect', 'interval', 'jitter', 'skew'):
+        values = stats[name]
+        print('{:>10} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            name, values['p50'] * 1000, values['p90'] * 1000, values['p99'] * 1000, values['max'] * 1000))
+
+
+parser = argparse.ArgumentParser(description='Open many synthetic websocket clients to a game server and measure '
+                                             'the frame delivery interval, jitter, fan-out skew between clients '
+                                             'and connection setup time.')
+parser.add_argument('--server', dest='server', metavar='URL', default=DEFAULT_SERVER_URL,
+                    help='Snakepit server URL (default: {})'.format(DEFAULT_SERVER_URL))
+parser.add_argument('--clients', dest='clients', metavar='N', type=int, default=100,
+                    help='number of websocket clients (default: 100)')
+parser.add_argument('--players', dest='players', metavar='N', type=int, default=1,
+                    help='number of clients which join the game; the rest only watch (default: 1)')
+parser.add_argument('--connect-rate', dest='connect_rate', metavar='N', type=float, default=100,
+                    help='new connections per second (default: 100)')
+parser.add_argument('--key-rate', dest='key_rate', metavar='N', type=float, default=0,
+                    help='average key presses per second of each player (default: 0)')
+parser.add_argument('--duration', dest='duration', metavar='SECONDS', type=float, default=30,
+                    help='test duration including the connection ramp-up (default: 30)')
+parser.add_argument('--protocol', dest='protocol', choices=Messaging.PROTOCOLS, default=Messaging.PROTOCOL_BINARY,
+                    help='encoding requested from the server (default: binary)')
+parser.add_argument('--spectators', dest='spectators', action='store_true',
+                    help='clients which do not join the game connect as spectators instead of idle players')
+parser.add_argument('--json', dest='json', action='store_true', help='print the results as JSON')
+
+args = parser.parse_args()
+logging.getLogger('snakepit').setLevel(logging.WARNING)
+raise_open_files_limit()
+load_test = LoadTest(args.clients, server_url=args.server, protocol=args.protocol, players=args.players,
+                     connect_rate=args.connect_rate, key_rate=args.key_rate, spectators=args.spectators)
+results = asyncio.get_event_loop().run_until_complete(load_test.run(args.duration))
+
+if args.json:
+    print(json.dumps(results))
+else:
+    print_stats(results)
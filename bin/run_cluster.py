@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+import os
+import sys
+import argparse
+
+try:
+    from snakepit import settings, cluster
+except ImportError:
+    print('snakepit Python package not found', file=sys.stderr)
+    sys.exit(64)
+
+
+parser = argparse.ArgumentParser(description='Run several game servers on this host behind a matchmaker which sends '
+                                             'new players to the least-loaded server and room.')
+parser.add_argument('--servers', dest='servers', metavar='N', type=int, default=os.cpu_count(),
+                    help='number of game server processes (default: number of CPUs)')
+parser.add_argument('--host', dest='host', metavar='HOST', default=settings.SERVER_HOST,
+                    help='listen address of the matchmaker and all game servers (default: all interfaces)')
+parser.add_argument('--port', dest='port', metavar='PORT', type=int, default=settings.SERVER_PORT,
+                    help='matchmaker port; game servers use the following ports (default: {})'.format(
+                        settings.SERVER_PORT))
+
+args = parser.parse_args()
+
+if args.servers < 1:
+    parser.error('at least one game server is required')
+
+cluster.run(host=args.host, port=args.port, servers=args.servers)
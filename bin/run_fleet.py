@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import subprocess
+from importlib import import_module
+
+try:
+    from snakepit import settings
+    from snakepit.robot_player import DEFAULT_SERVER_URL
+    from snakepit.robot_snake import RobotSnake
+except ImportError:
+    print('snakepit Python package not found', file=sys.stderr)
+    sys.exit(64)
+
+
+ROBOT_MODULE_DEFAULT = 'snakepit.robot_snake'
+
+
+def robot_spec(value):
+    # [module.]Class:count
+    path, _, count = value.partition(':')
+
+    try:
+        count = int(count or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid robot count: "%s"' % value)
+
+    if '.' in path:
+        module_name, class_name = path.rsplit('.', 1)
+    else:
+        module_name, class_name = ROBOT_MODULE_DEFAULT, path
+
+    try:
+        class_ = getattr(import_module(module_name), class_name, None)
+    except ImportError:
+        class_ = None
+
+    if not (isinstance(class_, type) and issubclass(class_, RobotSnake)):
+        raise argparse.ArgumentTypeError('Robot class "%s" does not inherit from RobotSnake' % path)
+
+    return class_, count
+
+
+def run_worker(args, shard=0, shards=1):
+    from snakepit.fleet import Fleet
+
+    fleet = Fleet(args.robots, server_url=args.server, decision_budget=args.budget, shard=shard, shards=shards)
+
+    return asyncio.get_event_loop().run_until_complete(fleet.run(duration=args.duration))
+
+
+def run_fleet(args):
+    if args.processes > 1:
+        # each worker process runs every n-th robot and prints its summary as JSON
+        workers = []
+
+        for shard in range(args.processes):
+            cmd = [sys.executable, os.path.abspath(__file__), '--worker', '%d/%d' % (shard, args.processes)]
+            workers.append(subprocess.Popen(cmd + sys.argv[1:], stdout=subprocess.PIPE))
+
+        results = []
+
+        for worker in workers:
+            output, _ = worker.communicate()
+
+            if worker.returncode == 0:
+                results.extend(json.loads(output.decode('utf-8')))
+            else:
+                print('Worker process failed with exit code %d' % worker.returncode, file=sys.stderr)
+    else:
+        results = run_worker(args)
+
+    print('{:>15} {:>12} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+        'name', 'robot', 'frames', 'skipped', 'misses', 'decided', 'p50 ms', 'p99 ms', 'lat. ms', 'score'))
+
+    for r in sorted(results, key=lambda i: -i['score']):
+        print('{:>15} {:>12} {:>8} {:>8} {:>8} {:>8} {:>10.3f} {:>10.3f} {:>10.1f} {:>8}'.format(
+            r['name'], r['robot'][:12], r['frames'], r['frames_skipped'], r['misses'], r['decisions'],
+            r['decision_p50'] * 1000, r['decision_p99'] * 1000, r['latency'], r['score']))
+
+    print('{:>15} {:>12} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+        'total', len(results), sum(r['frames'] for r in results), sum(r['frames_skipped'] for r in results),
+        sum(r['misses'] for r in results), sum(r['decisions'] for r in results), '', '', '',
+        sum(r['score'] for r in results)))
+
+
+def shard_spec(value):
+    try:
+        shard, shards = (int(i) for i in value.split('/', 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid shard: "%s"' % value)
+
+    return shard, shards
+
+
+parser = argparse.ArgumentParser(description='Run many robot players in one event loop (optionally sharded across '
+                                             'a few worker processes).')
+parser.add_argument('robots', metavar='CLASS:COUNT', type=robot_spec, nargs='+',
+                    help='robot snake class (module path or a class name from {}) and the number of robots; '
+                         'e.g. RandomRobotSnake:50'.format(ROBOT_MODULE_DEFAULT))
+parser.add_argument('--server', dest='server', metavar='URL', default=DEFAULT_SERVER_URL,
+                    help='Snakepit server URL (default: {})'.format(DEFAULT_SERVER_URL))
+parser.add_argument('--processes', dest='processes', metavar='N', type=int, default=1,
+                    help='number of worker processes (default: 1)')
+parser.add_argument('--duration', dest='duration', metavar='SECONDS', type=float, default=None,
+                    help='stop all robots after this time (default: run until all robots are dead)')
+parser.add_argument('--budget', dest='budget', metavar='FRACTION', type=float, default=settings.ROBOT_DECISION_BUDGET,
+                    help='run next_direction() in worker threads and give up after this fraction of the frame '
+                         'interval (default: {})'.format(settings.ROBOT_DECISION_BUDGET))
+parser.add_argument('--verbose', dest='verbose', action='store_true', help='log every robot message')
+parser.add_argument('--worker', dest='worker', metavar='SHARD/SHARDS', type=shard_spec, help=argparse.SUPPRESS)
+
+args = parser.parse_args()
+
+if not args.verbose:
+    logging.getLogger('snakepit').setLevel(logging.ERROR)
+
+if args.worker:
+    print(json.dumps(run_worker(args, *args.worker)))
+else:
+    run_fleet(args)
@@ -9,6 +9,7 @@ from importlib import import_module
 try:
     from snakepit.robot_player import RobotPlayer, DEFAULT_SERVER_URL
     from snakepit.robot_snake import RobotSnake
+    from snakepit import settings
 except ImportError:
     print('snakepit Python package not found', file=sys.stderr)
     sys.exit(64)
@@ -73,13 +74,14 @@ class RobotCode(argparse.FileType):
 def validate_robot_class(robot_snake_class):
     from snakepit.world import World
     from snakepit.snake import Snake as ServerSnake
+    from snakepit.frame_diff import FrameDiff
 
-    world = World()  # Create test world
-    robot_snake = robot_snake_class({}, world, 1)  # Create test player
-    server_snake = ServerSnake({}, world, 1)  # Create dummy server snake
-
-    for draw in server_snake.create():  # Simulate creating a new snake
-        world.update(draw)  # Draw new snake to test world
+    world = World(track_owners=True)  # Create test world
+    robot_snake = robot_snake_class({}, world, 1, owner=1)  # Create test player
+    server_snake = ServerSnake({}, world, 1, owner=1)  # Create dummy server snake
+    diff = FrameDiff()
+    server_snake.create(diff)  # Simulate creating a new snake
+    diff.apply(world)  # Draw new snake to test world
 
     robot_snake.next_direction(initial=True)  # Call next_direction() for the first time
     del server_snake
@@ -117,6 +119,9 @@ group.add_argument('--code', dest='code_', metavar='FILE', type=RobotCode('r'),
                    help='robot snake code file (use "-" to read from stdin)')
 parser.add_argument('--server', dest='server', metavar='URL', default=DEFAULT_SERVER_URL,
                     help='Snakepit server URL (default: {})'.format(DEFAULT_SERVER_URL))
+parser.add_argument('--budget', dest='budget', metavar='FRACTION', type=float, default=settings.ROBOT_DECISION_BUDGET,
+                    help='run next_direction() in a worker thread and give up after this fraction of the frame '
+                         'interval (default: {})'.format(settings.ROBOT_DECISION_BUDGET))
 parser.add_argument('--validate', dest='validate', action='store_true',
                     help='just validate the code and do not run it')
 
@@ -147,5 +152,6 @@ except ValueError:
 print('========  Creating new robot player "{!s}" using snake {!r} ======== '.format(robot_name, robot_class),
       file=sys.stderr)
 sys.stderr.flush()
-player = RobotPlayer(robot_name, player_id=robot_id, snake_class=robot_class, server_url=server_url)
+player = RobotPlayer(robot_name, player_id=robot_id, snake_class=robot_class, server_url=server_url,
+                     decision_budget=args.budget)
 player.run()
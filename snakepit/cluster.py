@@ -0,0 +1,306 @@
+import os
+import asyncio
+from uuid import uuid4
+from itertools import count
+from collections import OrderedDict
+from logging import getLogger
+from multiprocessing import Process
+from aiohttp import web, WSMsgType, ClientSession, ClientTimeout, ClientError
+
+from . import settings
+from . import server as game_server
+from .utils import get_client_address, validate_settings, validate_room_name
+from .messaging import json, Messaging
+from .exceptions import ValidationError
+
+logger = getLogger(__name__)
+
+DEFAULT_ROOM = settings.DEFAULT_ROOM
+
+
+class ServerLoad:
+    """
+    Last load report (see Rooms.load()) of one game server in the cluster.
+    """
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+        self.online = False
+        self.max_rooms = settings.MAX_ROOMS
+        self.rooms = {}  # room name -> load of the room
+        self.assigned = {}  # room name -> number of players sent to the room since the last report
+        self.overrun_rate = 0.0  # fraction of late frames since the previous report
+
+    def __repr__(self):
+        return '<%s [port=%s] [players=%s] [overrun_rate=%.3f]>' % (self.__class__.__name__, self.port, self.players,
+                                                                      self.overrun_rate)
+
+    def update(self, report):
+        rooms = report['rooms']
+        frames = overruns = 0
+
+        for name, room in rooms.items():
+            old = self.rooms.get(name, None)
+
+            if old and room['frames'] >= old['frames']:
+                frames += room['frames'] - old['frames']
+                overruns += room['overruns'] - old['overruns']
+
+        self.overrun_rate = overruns / frames if frames else 0.0
+        self.max_rooms = report['max_rooms']
+        self.rooms = rooms
+        self.assigned.clear()
+        self.online = True
+
+    def has_room(self, name):
+        # the room exists or it can be created on this server
+        return name in self.rooms or name in self.assigned or self.free_rooms > 0
+
+    def room_players(self, name):
+        return self.rooms.get(name, {}).get('players', 0) + self.assigned.get(name, 0)
+
+    @property
+    def free_rooms(self):
+        return self.max_rooms - len(self.rooms.keys() | self.assigned.keys())
+
+    @property
+    def players(self):
+        return sum(room['players'] for room in self.rooms.values()) + sum(self.assigned.values())
+
+
+class Matchmaker:
+    """
+    Entry point of a cluster of game servers running on one host.
+
+    New players and spectators are redirected (MSG_REDIRECT) to a game server and room chosen according to the load
+    reports polled from all servers. Players of the default room go to the least-loaded server and room with a free
+    place, named rooms stay on the server hosting them and players reconnecting with a known player ID are sent back
+    to their server and room.
+    """
+    def __init__(self, ports, max_players=settings.MAX_PLAYERS, interval=settings.CLUSTER_LOAD_INTERVAL,
+                 overrun_rate_max=settings.CLUSTER_OVERRUN_RATE_MAX, sticky_max=settings.CLUSTER_STICKY_PLAYERS_MAX):
+        self.servers = [ServerLoad(i, port) for i, port in enumerate(ports)]
+        self.max_players = max_players
+        self.interval = interval
+        self.overrun_rate_max = overrun_rate_max
+        self.sticky_max = sticky_max
+        self._players = OrderedDict()  # player ID -> (server, room); least recently used first
+        self._rooms = OrderedDict()  # named room -> server; least recently used first
+        self._overflow_rooms = count(2)
+
+    def __repr__(self):
+        return '<%s [servers=%d]>' % (self.__class__.__name__, len(self.servers))
+
+    def _remember(self, mapping, key, value):
+        mapping[key] = value
+        mapping.move_to_end(key)
+
+        if len(mapping) > self.sticky_max:
+            mapping.popitem(last=False)
+
+    def _is_busy(self, server):
+        return server.overrun_rate > self.overrun_rate_max
+
+    @staticmethod
+    def _is_default_room(name):
+        return name == DEFAULT_ROOM or name.startswith(DEFAULT_ROOM + '-')
+
+    def _choose_new_room_server(self, servers):
+        # the least-loaded server which can open another room or None
+        servers = [server for server in servers if server.free_rooms > 0]
+
+        return min(servers, key=lambda s: (self._is_busy(s), s.players, s.index), default=None)
+
+    def _choose_default_room(self, servers, spectator=False):
+        candidates = []
+
+        for server in servers:
+            names = {DEFAULT_ROOM}
+            names.update(name for name in server.rooms if self._is_default_room(name))
+            names.update(name for name in server.assigned if self._is_default_room(name))
+
+            for name in names:
+                if not server.has_room(name):
+                    continue
+
+                players = server.room_players(name)
+
+                if spectator:
+                    # spectators watch the busiest game
+                    candidates.append(((-players, server.index, name), server, name))
+                elif players < self.max_players:
+                    candidates.append(((self._is_busy(server), server.players, players, server.index, name),
+                                       server, name))
+
+        if candidates:
+            _, server, name = min(candidates)
+            return server, name
+
+        # all rooms are full - open a new one on the least-loaded server
+        server = self._choose_new_room_server(servers)
+
+        if not server:
+            return None
+
+        return server, '%s-%d' % (DEFAULT_ROOM, next(self._overflow_rooms))
+
+    def _choose_room_server(self, name, servers):
+        for server in servers:
+            if name in server.rooms:
+                break
+        else:
+            server = self._rooms.get(name, None)
+
+            if not server or not server.online or not server.has_room(name):
+                server = self._choose_new_room_server(servers)
+
+                if not server:
+                    return None
+
+        self._remember(self._rooms, name, server)
+
+        return server
+
+    def choose(self, room=None, player_id=None, spectator=False):
+        # (server, room) for a new player or spectator or None if no server is available
+        servers = [server for server in self.servers if server.online]
+
+        if not servers:
+            return None
+
+        target = self._players.get(player_id, None) if player_id else None
+
+        # a known player goes back to the same server unless another room was requested
+        if target and target[0].online and room in (None, target[1]):
+            self._players.move_to_end(player_id)
+            return target
+
+        if room is None:
+            target = self._choose_default_room(servers, spectator=spectator)
+        else:
+            server = self._choose_room_server(room, servers)
+            target = (server, room) if server else None
+
+        if target and not spectator:
+            server, name = target
+            server.assigned[name] = server.assigned.get(name, 0) + 1
+
+            if player_id:
+                self._remember(self._players, player_id, target)
+
+        return target
+
+    async def _poll(self, session, server):
+        try:
+            async with session.get('http://127.0.0.1:%d/load' % server.port) as response:
+                server.update(await response.json(loads=json.loads))
+        except (ClientError, asyncio.TimeoutError, ValueError) as exc:
+            if server.online:
+                logger.error('Game server %r is not available: %r', server, exc)
+
+            server.online = False
+
+    async def poller(self):
+        async with ClientSession(timeout=ClientTimeout(total=self.interval)) as session:
+            while True:
+                await asyncio.gather(*(self._poll(session, server) for server in self.servers))
+                await asyncio.sleep(self.interval)
+
+    async def _redirect(self, request, ws, data, room):
+        spectator = data[0] == Messaging.MSG_SPECTATE
+
+        if spectator:
+            player_id = None
+        else:
+            # noinspection PyProtectedMember
+            _, player_id, _ = game_server._get_new_player_info(data)
+            # the player ID is assigned here so that the player can be sent back to the same server
+            player_id = player_id or str(uuid4())
+
+        target = self.choose(room=room, player_id=player_id, spectator=spectator)
+
+        if not target:
+            raise ValidationError('No game server is available.')
+
+        server, room = target
+        url = '%s://%s:%d/connect/%s' % (request.scheme, request.url.host, server.port, room)
+        logger.info('Redirecting %s to %s', get_client_address(request), url)
+        await ws.send_json([Messaging.MSG_REDIRECT, url, player_id], dumps=json.dumps)
+
+    async def ws_handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        room = request.match_info.get('room', None)
+
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+
+            try:
+                data = json.loads(msg.data)
+            except ValueError:
+                continue
+
+            if not isinstance(data, list) or not data:
+                continue
+
+            if data[0] == Messaging.MSG_PING:
+                await ws.send_json([Messaging.MSG_PONG] + data[1:], dumps=json.dumps)
+            elif data[0] in (Messaging.MSG_NEW_PLAYER, Messaging.MSG_SPECTATE):
+                try:
+                    await self._redirect(request, ws, data, validate_room_name(room) if room else None)
+                except ValidationError as exc:
+                    logger.error('Cannot redirect %s: %r', get_client_address(request), exc)
+                    await ws.send_json([Messaging.MSG_ERROR, str(exc)])
+
+                break
+
+        await ws.close()
+
+        return ws
+
+
+def _run_server(index, host, port, debug):
+    # every server keeps its own top scores
+    root, ext = os.path.splitext(settings.TOP_SCORES_FILE)
+    settings.TOP_SCORES_FILE = '%s_%d%s' % (root, index, ext)
+    game_server.run(host=host, port=port, debug=debug)
+
+
+def run(host=settings.SERVER_HOST, port=settings.SERVER_PORT, servers=os.cpu_count(), debug=settings.DEBUG):
+    """
+    Run a number of game servers (on the ports following the port) and a matchmaker on the port.
+    """
+    validate_settings(settings)
+
+    ports = [port + i + 1 for i in range(servers)]
+    processes = [Process(target=_run_server, args=(i, host, server_port, debug), name='snakepit-server-%d' % i)
+                 for i, server_port in enumerate(ports)]
+
+    for process in processes:
+        process.start()
+
+    matchmaker = Matchmaker(ports)
+
+    async def on_startup(app):
+        app['poller'] = asyncio.ensure_future(matchmaker.poller())
+
+    async def on_cleanup(app):
+        app['poller'].cancel()
+
+        for process in processes:
+            process.terminate()
+
+        for process in processes:
+            process.join()
+
+    app = web.Application(debug=debug)
+    app.router.add_route('GET', '/connect', matchmaker.ws_handler)
+    app.router.add_route('GET', '/connect/{room}', matchmaker.ws_handler)
+    app.router.add_static('/', settings.WEB_ROOT)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    logger.info('Matchmaker for %d game server(s) on ports %d-%d', servers, ports[0], ports[-1])
+    web.run_app(app, host=host, port=port)
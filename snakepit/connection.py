@@ -0,0 +1,139 @@
+import asyncio
+from collections import deque
+from logging import getLogger
+
+from . import settings
+from .messaging import json, Messaging
+
+logger = getLogger(__name__)
+
+
+class Connection:
+    """
+    WebSocket connection with a bounded outbound queue drained by its own writer task.
+    """
+    POLICY_COALESCE = 'coalesce'  # merge the oldest queued messages into one
+    POLICY_DROP_SPECTATORS = 'drop_spectators'  # disconnect lagging spectators, coalesce for players
+    POLICY_DISCONNECT = 'disconnect'  # disconnect any lagging connection
+    POLICIES = frozenset([POLICY_COALESCE, POLICY_DROP_SPECTATORS, POLICY_DISCONNECT])
+
+    def __init__(self, ws, protocol=Messaging.PROTOCOL_JSON, spectator=False,
+                 queue_size=settings.SEND_QUEUE_SIZE, policy=settings.SEND_QUEUE_POLICY):
+        self.ws = ws
+        self.protocol = protocol
+        self.spectator = spectator
+        self.queue_size = queue_size
+        self.policy = policy
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._lagging = False
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.ensure_future(self._write())
+
+    def __repr__(self):
+        return '<%s [protocol=%s] [queue=%d]>' % (self.__class__.__name__, self.protocol, len(self._queue))
+
+    @property
+    def closed(self):
+        return self.ws.closed or self._lagging
+
+    @property
+    def close_code(self):
+        return self.ws.close_code
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def encode(self, messages):
+        if self.protocol == Messaging.PROTOCOL_BINARY:
+            return Messaging.encode_binary(messages)
+        else:
+            return json.dumps(messages)
+
+    @staticmethod
+    def decode(payload):
+        if isinstance(payload, bytes):
+            return Messaging.decode_binary(payload)
+        else:
+            return json.loads(payload)
+
+    def send(self, messages, payload=None):
+        # queue a list of messages (and their encoded form) without waiting for the socket; messages can be None
+        # if the payload is already encoded (they are decoded from the payload only if the queue gets full)
+        if self.closed:
+            return
+
+        if payload is None:
+            payload = self.encode(messages)
+
+        if len(self._queue) >= self.queue_size:
+            if self.policy == self.POLICY_DISCONNECT or (self.spectator and self.policy == self.POLICY_DROP_SPECTATORS):
+                self._disconnect_laggard()
+                return
+
+            self._coalesce(self.decode(payload) if messages is None else messages)
+        else:
+            self._queue.append((messages, payload))
+
+        self._wakeup.set()
+
+    def _coalesce(self, messages):
+        # merge everything queued with the new messages into one up-to-date message
+        queued = []
+
+        for queued_messages, payload in self._queue:
+            queued.extend(self.decode(payload) if queued_messages is None else queued_messages)
+
+        self.coalesced += len(self._queue)
+        self._queue.clear()
+        merged = Messaging.merge_messages(queued + messages)
+        self._queue.append((merged, self.encode(merged)))
+
+    def _disconnect_laggard(self):
+        logger.warning('Disconnecting lagging %r', self)
+        self.dropped += len(self._queue) + 1
+        self._queue.clear()
+        self._lagging = True
+        asyncio.ensure_future(self.close(code=Messaging.WSCloseCode.TRY_AGAIN_LATER, message='Connection too slow'))
+
+    async def _write(self):
+        ws = self.ws
+        queue = self._queue
+
+        try:
+            while True:
+                while not queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+
+                messages, payload = queue.popleft()
+
+                if ws.closed:
+                    self.dropped += 1
+                    continue
+
+                if isinstance(payload, bytes):
+                    await ws.send_bytes(payload)
+                else:
+                    await ws.send_str(payload)
+
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            logger.error('Failed to send message to %r: %r', self, exc)
+            self.dropped += len(queue)
+            queue.clear()
+            # nothing drains the queue anymore - the connection is closed and the game disconnects it
+            self._lagging = True
+            asyncio.ensure_future(ws.close(code=Messaging.WSCloseCode.INTERNAL_ERROR, message='Send failed'))
+
+    async def close(self, **kwargs):
+        self.shutdown()
+        await self.ws.close(**kwargs)
+
+    def shutdown(self):
+        self._writer.cancel()
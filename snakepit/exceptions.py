@@ -12,3 +12,7 @@ class SnakePlacementError(SnakeError):
 
 class ValidationError(ValueError):
     pass
+
+
+class TooManyRooms(Exception):
+    pass
@@ -0,0 +1,78 @@
+import asyncio
+from logging import getLogger
+from aiohttp import ClientSession, ClientError, TCPConnector
+
+from . import settings
+from .robot_player import RobotPlayer, DEFAULT_SERVER_URL
+
+logger = getLogger(__name__)
+
+NAME_LENGTH_MAX = 15
+
+
+class Fleet:
+    """
+    Many robot players running concurrently in one event loop and sharing one HTTP connection pool.
+    """
+    def __init__(self, robots, server_url=DEFAULT_SERVER_URL, decision_budget=settings.ROBOT_DECISION_BUDGET,
+                 ping_pong_enabled=True, shard=0, shards=1):
+        # robots is a list of (snake_class, count) pairs; with shards > 1 only every shards-th robot is created
+        self.server_url = server_url
+        self.players = []
+        i = 0
+
+        for snake_class, count in robots:
+            prefix = snake_class.__name__.replace('RobotSnake', '') or 'Robot'
+
+            for _ in range(count):
+                if i % shards == shard:
+                    suffix = str(i)
+                    name = prefix[:NAME_LENGTH_MAX - len(suffix)] + suffix
+                    player = RobotPlayer(name, snake_class=snake_class, server_url=server_url,
+                                         decision_budget=decision_budget)
+                    player.ping_pong_enabled = ping_pong_enabled
+                    self.players.append(player)
+
+                i += 1
+
+    def __repr__(self):
+        return '<%s [players=%d] [server=%s]>' % (self.__class__.__name__, len(self.players), self.server_url)
+
+    async def _run_player(self, player, session):
+        player.running = True
+        ping_pong = None
+
+        if player.ping_pong_enabled:
+            ping_pong = asyncio.ensure_future(player.ping_pong())
+
+        try:
+            await player.ws_session(session=session)
+        except (RuntimeError, SystemError, ClientError) as exc:
+            logger.warning('%r stopped: %r', player, exc)
+        finally:
+            player.running = False
+
+            if ping_pong:
+                ping_pong.cancel()
+
+    async def run(self, duration=None):
+        logger.info('Running %r', self)
+        # no limit on the number of connections in the shared pool - each robot holds one websocket connection
+        async with ClientSession(connector=TCPConnector(limit=0)) as session:
+            tasks = [asyncio.ensure_future(self._run_player(player, session)) for player in self.players]
+
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=duration)
+
+                for task in pending:
+                    task.cancel()
+
+                if pending:
+                    await asyncio.wait(pending)
+
+        RobotPlayer.shutdown_executor()
+
+        return self.summary()
+
+    def summary(self):
+        return [player.summary() for player in self.players]
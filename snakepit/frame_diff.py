@@ -0,0 +1,100 @@
+from array import array
+
+from .world import World
+from .messaging import Messaging
+
+CLEAN = 0
+APPLIED = 1  # changed during this frame and already applied to the world
+PENDING = 2  # changed since the last apply()
+
+
+class FrameDiff:
+    """
+    Reusable buffer of cell changes rendered during one frame: a map of dirty cells with parallel char, color and
+    owner arrays.
+
+    Repeated changes of one cell are merged - the last one wins, but the cell keeps the position of its first change.
+    Pending changes are applied to the world in batches, while render messages are created once for the whole frame.
+    """
+    __slots__ = ('_size_x', '_chars', '_colors', '_owners', '_states', '_cells', '_pending')
+
+    def __init__(self, size_x=World.SIZE_X, size_y=World.SIZE_Y):
+        size = size_x * size_y
+        self._size_x = size_x
+        self._chars = bytearray(size)
+        self._colors = array('H', [0]) * size
+        self._owners = array('H', [0]) * size
+        self._states = bytearray(size)
+        self._cells = array('l')  # changed cells in the order of their first change
+        self._pending = array('l')  # cells changed since the last apply() in the same order
+
+    def __repr__(self):
+        return '<%s [cells=%d] [pending=%d]>' % (self.__class__.__name__, len(self._cells), len(self._pending))
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __contains__(self, i):
+        return self._states[i] != CLEAN
+
+    def get_char(self, i):
+        # character rendered into the cell during this frame or None
+        if self._states[i] == CLEAN:
+            return None
+
+        return chr(self._chars[i])
+
+    def set_cell(self, i, char, color, owner=0):
+        state = self._states[i]
+
+        if state != PENDING:
+            if state == CLEAN:
+                self._cells.append(i)
+
+            self._pending.append(i)
+            self._states[i] = PENDING
+
+        self._chars[i] = ord(char)
+        self._colors[i] = color
+        self._owners[i] = owner
+
+    def set(self, x, y, char, color, owner=0):
+        self.set_cell(y * self._size_x + x, char, color, owner)
+
+    def apply(self, world):
+        # write pending changes into the world; return the number of changed cells
+        chars = self._chars
+        colors = self._colors
+        owners = self._owners
+        states = self._states
+        pending = self._pending
+        set_cell = world.set_cell
+
+        for i in pending:
+            set_cell(i, chr(chars[i]), colors[i], owners[i])
+            states[i] = APPLIED
+
+        count = len(pending)
+        del pending[:]
+
+        return count
+
+    def messages(self):
+        # render messages of all changes in this frame
+        size_x = self._size_x
+        chars = self._chars
+        colors = self._colors
+        owners = self._owners
+        msg_render = Messaging.MSG_RENDER
+
+        return [[msg_render, i % size_x, i // size_x, chr(chars[i]), colors[i], owners[i]] for i in self._cells]
+
+    def clear(self):
+        # start a new frame; pending changes are discarded
+        states = self._states
+
+        for i in self._cells:
+            states[i] = CLEAN
+
+        del self._cells[:]
+        del self._pending[:]
@@ -1,14 +1,25 @@
+import os
+import asyncio
+from time import perf_counter
 from logging import getLogger
+from heapq import heappush, heappop
 from random import randint, choice
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from uuid import uuid4
 
 from . import settings
 from .world import World
 from .snake import Snake
 from .player import Player
+from .connection import Connection
+from .moves import Moves
+from .scheduler import FrameScheduler
+from .top_scores import TopScores
+from .metrics import GameMetrics
+from .replay import ReplayRecorder
+from .viewport import Viewports
+from .frame_diff import FrameDiff
 from .messaging import json, Messaging
-from .datatypes import Char, Draw, Render
 from .exceptions import SnakeError
 
 logger = getLogger(__name__)
@@ -16,32 +27,149 @@ logger = getLogger(__name__)
 
 class Game(Messaging):
     GAME_OVER_TEXT = ">>> GAME OVER <<<"
-
-    def __init__(self):
-        self._colors = []
+    connection_class = Connection
+
+    def __init__(self, name=settings.DEFAULT_ROOM, top_scores=None):
+        self.name = name
+        self.loop_task = None
+        self._colors = list(range(1, settings.NUM_COLORS + 1))  # color 0 is reserved for interface and stones
+        self._color_users = Counter()
+        self._free_owners = []  # heap of returned player indexes
+        self._next_owner = 1  # owner 0 means nobody
         self._players = OrderedDict()
-        self._top_scores = self._read_top_scores()
-        self._world = World()
+        self._players_by_owner = {}
+        self._spectators = {}  # protocol -> set of spectator connections
+        self._world_message = None  # cached MSG_WORLD message and its JSON payload
+        self._viewport_snapshots = set()  # players which have entered a new region
+        self._top_scores = TopScores(self._get_top_scores_file(name)) if top_scores is None else top_scores
+        self._world = World(track_free_cells=True, track_owners=True)
+        self._diff = FrameDiff()  # cell changes of the current frame
+        self._outbox = []  # messages for all collected until the end of the frame (see _flush())
+        self._top_scores_changed = False
         self.frame = 0
         self.running = False
+        self.sessions = 0  # client sessions attached to this game, including those without a player (see Session)
         self.speed = settings.GAME_SPEED
+        self.scheduler = FrameScheduler(self.speed)
+        self.metrics = GameMetrics(name)
+
+        if settings.REPLAY_DIR:
+            self.recorder = ReplayRecorder.create(settings.REPLAY_DIR, name)
+        else:
+            self.recorder = None
+
+        if settings.VIEWPORT_SIZE_X and settings.VIEWPORT_SIZE_Y:
+            self.viewports = Viewports(self._world, settings.VIEWPORT_SIZE_X, settings.VIEWPORT_SIZE_Y)
+        else:
+            self.viewports = None
+
+        self._game_over_time = 0.0
         self.settings = {attr: getattr(settings, attr) for attr, _ in settings.SNAKEPIT_SETTINGS}
 
     def __repr__(self):
-        return '<%s [players=%s]>' % (self.__class__.__name__, len(self._players))
+        return '<%s [name=%s] [players=%s]>' % (self.__class__.__name__, self.name, len(self._players))
 
     async def _send_msg(self, player, *args):
         for ws in player.wss:
             await self._send_one(ws, [args])
 
+        self.metrics.messages_sent.inc(len(player.wss))
+
     async def _send_msg_all_multi(self, messages):
         if messages:
-            wss = (ws for player in self._players.values() for ws in player.wss)
-            await self._send_all(wss, messages)
+            if self.recorder:
+                self.recorder.add(messages)
+
+            wss = {}
+
+            # other messages than cell changes do not depend on the viewports
+            if self.viewports and (self._viewport_snapshots or any(msg[0] == self.MSG_RENDER for msg in messages)):
+                self._send_msg_viewports(messages)
+            else:
+                for player in self._players.values():
+                    for ws in player.wss:
+                        wss.setdefault(ws.protocol, []).append(ws)
+
+            for protocol, spectators in self._spectators.items():
+                if spectators:
+                    wss.setdefault(protocol, []).extend(spectators)
+
+            # messages are encoded only once per protocol and the payload is shared by all connections
+            for protocol, protocol_wss in wss.items():
+                await self._send_all(protocol_wss, messages, protocol=protocol)
+                self.metrics.messages_sent.inc(len(protocol_wss))
+
+    def _send_msg_viewports(self, messages):
+        # players receive only the cell changes inside their viewports; equal viewports share the payload
+        viewports = self.viewports
+        others = [msg for msg in messages if msg[0] != self.MSG_RENDER]
+        regions = viewports.index(messages)
+        snapshots = self._viewport_snapshots
+        batches = {}  # (viewport, snapshot) -> messages
+        payloads = {}  # (batch id, protocol) -> encoded messages
+        sent = 0
+
+        for player in self._players.values():
+            key = (player.viewport, player in snapshots)
+            batch = batches.get(key, None)
+
+            if batch is None:
+                if key[1]:  # the snapshot already contains all rendered changes
+                    batch = others + viewports.get_snapshot(player.viewport)
+                else:
+                    renders = viewports.get_renders(regions, player.viewport)
+                    # viewports without changes share one batch
+                    batch = others + renders if renders else others
+
+                batches[key] = batch
+
+            if not batch:
+                continue
+
+            for ws in player.wss:
+                if ws.closed:
+                    continue
+
+                payload_key = (id(batch), ws.protocol)
+                payload = payloads.get(payload_key, None)
+
+                if payload is None:
+                    payload = payloads[payload_key] = ws.encode(batch)
+
+                ws.send(batch, payload)
+                sent += 1
+
+        snapshots.clear()
+        self.metrics.messages_sent.inc(sent)
+
+    def _move_viewports(self):
+        # viewports follow the snakes' heads
+        for player in self._players.values():
+            if player.alive and player.snake.body:
+                viewport = self.viewports.get_viewport(player.snake.body[0], player.viewport)
+
+                if viewport != player.viewport:
+                    player.viewport = viewport
+                    self._viewport_snapshots.add(player)
 
     async def _send_msg_all(self, *args):
         await self._send_msg_all_multi([args])
 
+    def _broadcast(self, *args):
+        # the message is sent to all by the next _flush()
+        self._outbox.append(list(args))
+
+    async def _flush(self):
+        # collected messages, top scores and cell changes are sent to all as one message
+        messages, self._outbox = self._outbox, []
+
+        if self._top_scores_changed:
+            self._top_scores_changed = False
+            messages.append([self.MSG_TOP_SCORES, self.top_scores])
+
+        messages += self._render_messages()
+        await self._send_msg_all_multi(messages)
+
     async def send_error_all(self, msg):
         await self._send_msg_all(self.MSG_ERROR, msg)
 
@@ -51,160 +179,222 @@ class Game(Messaging):
             await cls._close(ws, **kwargs)
 
     @staticmethod
-    def _read_top_scores():
-        try:
-            with open(settings.TOP_SCORES_FILE, 'r+') as fp:
-                content = fp.read()
-
-                if content:
-                    top_scores = json.loads(content)
-                else:
-                    top_scores = []
-        except FileNotFoundError:
-            top_scores = []
+    def _get_top_scores_file(name):
+        # every room has its own top scores
+        if name == settings.DEFAULT_ROOM:
+            return settings.TOP_SCORES_FILE
 
-        return top_scores
+        root, ext = os.path.splitext(settings.TOP_SCORES_FILE)
 
-    def _store_top_scores(self):
-        with open(settings.TOP_SCORES_FILE, 'w') as fp:
-            fp.write(json.dumps(self._top_scores))
-            fp.close()
-
-    def _calc_top_scores(self, player):
-        if not player.score:
-            return
-
-        ts_dict = dict(self._top_scores)
-
-        if player.score <= ts_dict.get(player.name, 0):
-            return
-
-        ts_dict[player.name] = player.score
-        self._top_scores = sorted(ts_dict.items(), key=lambda x: -x[1])[:settings.MAX_TOP_SCORES]
+        return '%s_%s%s' % (root, name, ext)
 
     @staticmethod
     def _pick_random_color():
         return randint(1, settings.NUM_COLORS)
 
     def _pick_player_color(self):
-        # pick a random color
-        if not len(self._colors):
-            # color 0 is reserved for interface and stones
-            self._colors = list(range(1, settings.NUM_COLORS + 1))
+        # pick a random unused color; colors are only displayed and repeat if there are more snakes than colors
+        if self._colors:
+            color = choice(self._colors)
+            self._colors.remove(color)
+        else:
+            color = self._pick_random_color()
 
-        color = choice(self._colors)
-        self._colors.remove(color)
+        self._color_users[color] += 1
 
         return color
 
     def _return_player_color(self, color):
-        self._colors.append(color)
+        self._color_users[color] -= 1
 
-    @staticmethod
-    def _render_text(text, color):
+        if not self._color_users[color]:
+            self._colors.append(color)
+
+    def _pick_owner(self):
+        # the smallest free player index identifies the owner of a living snake's cells in the world
+        if self._free_owners:
+            return heappop(self._free_owners)
+
+        owner = self._next_owner
+        self._next_owner += 1
+
+        return owner
+
+    def _return_owner(self, owner):
+        heappush(self._free_owners, owner)
+
+    def _render_text(self, text, color):
         # render in the center of play field
         pos_y = int(World.SIZE_Y / 2)
         pos_x = int(World.SIZE_X / 2 - len(text)/2)
-        render = []
 
         for i in range(0, len(text)):
-            render.append(Draw(pos_x + i, pos_y, text[i], color))
+            self._diff.set(pos_x + i, pos_y, text[i], color)
 
-        return render
+    def _render_game_over_text(self):
+        # rendered after the last snake dies
+        if not self.players_alive_count:
+            self._render_text(self.GAME_OVER_TEXT, self._pick_random_color())
 
-    def _apply_render(self, render):
-        messages = []
+    def _apply_render(self):
+        # apply pending cell changes to the world
+        if self._diff.apply(self._world):
+            self._world_message = None
 
-        for draw in render:
-            # apply to local
-            self._world[draw.y][draw.x] = Char(draw.char, draw.color)
-            # send messages
-            messages.append([self.MSG_RENDER] + list(draw))
+    def _render_messages(self):
+        # render messages of all cell changes since the last call
+        self._apply_render()
+        messages = self._diff.messages()
+        self._diff.clear()
 
         return messages
 
     async def reset_world(self):
         self.frame = 0
         self.speed = settings.GAME_SPEED
+        self.scheduler.set_speed(self.speed)
         self._world.reset()
+        self._world_message = None
         await self._send_msg_all(self.MSG_RESET_WORLD)
 
     def _get_spawn_place(self):
-        for i in range(0, 2):
-            x = randint(0, World.SIZE_X - 1)
-            y = randint(0, World.SIZE_Y - 1)
+        pos = self._world.random_free_position()
 
-            if self._world[y][x].char == World.CH_VOID:
-                return x, y
+        if not pos:
+            logger.debug('There is no free place in the world')
+        elif self._diff.get_char(pos.y * World.SIZE_X + pos.x) not in (None, World.CH_VOID):
+            logger.debug('Spawn place %s was taken earlier in this frame', pos)
+            return None
 
-        return None, None
+        return pos
 
     def spawn_digit(self, right_now=False):
-        render = []
-
         if right_now or randint(1, 100) <= settings.DIGIT_SPAWN_RATE:
-            x, y = self._get_spawn_place()
+            pos = self._get_spawn_place()
 
-            if x and y:
+            if pos:
                 char = str(randint(settings.DIGIT_MIN, settings.DIGIT_MAX))
                 color = self._pick_random_color()
-                render += [Draw(x, y, char, color)]
-
-        return render
+                self._diff.set(pos.x, pos.y, char, color)
+                self.metrics.digit_spawns.inc()
 
     def spawn_stone(self, right_now=False):
-        render = []
-
         if right_now or randint(1, 100) <= settings.STONE_SPAWN_RATE:
-            x, y = self._get_spawn_place()
-
-            if x and y:
-                render += [Draw(x, y, World.CH_STONE, World.COLOR_0)]
+            pos = self._get_spawn_place()
 
-        return render
+            if pos:
+                self._diff.set(pos.x, pos.y, World.CH_STONE, World.COLOR_0)
+                self.metrics.stone_spawns.inc()
 
     @property
     def top_scores(self):
-        return [(t[0], t[1], randint(1, settings.NUM_COLORS)) for t in self._top_scores]
+        return [(name, score, randint(1, settings.NUM_COLORS)) for name, score in self._top_scores]
+
+    @property
+    def world(self):
+        return self._world
+
+    @property
+    def players_count(self):
+        return len(self._players)
+
+    @property
+    def spectators_count(self):
+        return sum(len(spectators) for spectators in self._spectators.values())
 
     @property
     def players_alive_count(self):
         return sum(int(p.alive) for p in self._players.values())
 
-    def get_player_by_color(self, color):
-        for player in self._players.values():
-            if player.color == color:
-                return player
+    def send_queue_stats(self):
+        connections = [ws for player in self._players.values() for ws in player.wss]
+        connections.extend(ws for spectators in self._spectators.values() for ws in spectators)
+
+        return {
+            'connections': len(connections),
+            'queue_depth': sum(ws.queue_depth for ws in connections),
+            'queue_depth_max': max((ws.queue_depth for ws in connections), default=0),
+            'sent': sum(ws.sent for ws in connections),
+            'coalesced': sum(ws.coalesced for ws in connections),
+            'dropped': sum(ws.dropped for ws in connections),
+        }
+
+    def get_player_by_owner(self, owner):
+        return self._players_by_owner.get(owner, None)
+
+    def get_state_messages(self):
+        # everything a new client needs to know about the game except the world itself
+        messages = [[self.MSG_SYNC, self.frame, self.speed], [self.MSG_TOP_SCORES, self.top_scores]]
+
+        for p in self._players.values():
+            if p.alive:
+                messages.append([self.MSG_P_JOINED, p.id, p.name, p.color, p.score, p.snake.owner])
+
+        return messages
+
+    def get_world_message(self):
+        # the world snapshot is encoded only once between two world changes, however many clients connect
+        if self._world_message is None:
+            messages = [[self.MSG_WORLD, self._world.snapshot()]]
+            self._world_message = (messages, json.dumps(messages))
+
+        return self._world_message
+
+    def _send_game_state(self, connection, viewport=None):
+        state = self.get_state_messages()
+        connection.send(state[:1], json.dumps(state[:1]))  # sync
+
+        if viewport is None:
+            connection.send(*self.get_world_message())
+        elif self.viewports.minimap:
+            connection.send([self.viewports.minimap] + self.viewports.get_snapshot(viewport))
+        else:
+            connection.send(self.viewports.get_snapshot(viewport))
+
+        connection.send(state[1:], json.dumps(state[1:]))  # top scores and players
+        self.metrics.messages_sent.inc(3)
 
-        return None
+    async def new_player(self, name, ws, player_id=None, protocol=Messaging.PROTOCOL_JSON):
+        connection = self.connection_class(ws, protocol=protocol)
 
-    async def new_player(self, name, ws, player_id=None):
         if player_id:
             if player_id in self._players:
                 player = self._players[player_id]
                 logger.info('Adding new connection to %r', player)
-                player.add_connection(ws)
+                player.add_connection(connection)
 
                 return player
         else:
             player_id = str(uuid4())
 
-        player = Player(player_id, name, ws)
+        player = Player(player_id, name, connection)
         logger.info('Creating new %r', player)
 
-        await self._send_msg(player, self.MSG_HANDSHAKE, player.name, player.id, self.settings)
-        await self._send_msg(player, self.MSG_SYNC, self.frame, self.speed)
-        await self._send_msg(player, self.MSG_WORLD, self._world)
-        await self._send_msg(player, self.MSG_TOP_SCORES, self.top_scores)
-
-        for p in self._players.values():
-            if p.alive:
-                await self._send_msg(player, self.MSG_P_JOINED, p.id, p.name, p.color, p.score)
+        if self.viewports:
+            player.viewport = self.viewports.get_viewport()
 
+        await self._send_msg(player, self.MSG_HANDSHAKE, player.name, player.id, self.settings, protocol)
+        self._send_game_state(connection, viewport=player.viewport)
         self._players[player.id] = player
 
         return player
 
+    async def new_spectator(self, ws, protocol=Messaging.PROTOCOL_JSON):
+        # spectators only receive broadcasts; they have no player, name or snake
+        connection = self.connection_class(ws, protocol=protocol, spectator=True)
+        logger.info('Adding new spectator %r', connection)
+
+        await self._send_one(connection, [[self.MSG_HANDSHAKE, None, None, self.settings, protocol]])
+        self._send_game_state(connection)
+        self._spectators.setdefault(protocol, set()).add(connection)
+
+        return connection
+
+    def spectator_disconnected(self, connection):
+        logger.info('Removing spectator %r', connection)
+        connection.shutdown()
+        self._spectators.get(connection.protocol, set()).discard(connection)
+
     async def join(self, player):
         if player.alive:
             return
@@ -214,30 +404,31 @@ class Game(Messaging):
             return
 
         color = self._pick_player_color()
+        owner = self._pick_owner()
 
         # init snake
-        player.new_snake(self.settings, self._world, color)
+        player.new_snake(self.settings, self._world, color, owner=owner)
+        self._players_by_owner[owner] = player
         # notify all about new player
-        await self._send_msg_all(self.MSG_P_JOINED, player.id, player.name, player.color, player.score)
+        await self._send_msg_all(self.MSG_P_JOINED, player.id, player.name, player.color, player.score, owner)
 
-    async def game_over(self, player, ch_hit=None, frontal_crash=False, force=False):
+    async def game_over(self, player, ch_hit=None, killer=None, frontal_crash=False, force=False):
         logger.debug('=> Game over for %r', player)
+        start = perf_counter()
         player.alive = False
-        messages = [[self.MSG_P_GAMEOVER, player.id]]
+        self._broadcast(self.MSG_P_GAMEOVER, player.id)
 
         if frontal_crash:
             logger.info('%r died together with another snake', player)
         elif ch_hit and ch_hit.char in Snake.BODY_CHARS:
             # someone has killed this player
-            killer = self.get_player_by_color(ch_hit.color)
-
             if killer:
                 if killer == player:
                     logger.info('%r committed suicide', player)
                 elif killer.alive:
                     logger.info('%r was killed by %r', player, killer)
                     killer.score += settings.KILL_POINTS
-                    messages.append([self.MSG_P_SCORE, killer.id, killer.score])
+                    self._broadcast(self.MSG_P_SCORE, killer.id, killer.score)
                 else:
                     logger.info('%r crashed into a dying snake', player)
             else:
@@ -251,212 +442,196 @@ class Game(Messaging):
         else:
             logger.info('%r crashed into the wall', player)
 
-        await self._send_msg_all_multi(messages)
+        # the player index stays mapped to this player until it is picked again, because
+        # the dead snake's cells still carry the index until the end of the frame
         self._return_player_color(player.color)
-        self._calc_top_scores(player)
-        self._store_top_scores()
-        await self._send_msg_all(self.MSG_TOP_SCORES, self.top_scores)
+        self._return_owner(player.snake.owner)
 
-        render = player.snake.render_game_over()
-
-        if not self.players_alive_count:
-            render += self._render_text(self.GAME_OVER_TEXT, self._pick_random_color())
+        if self._top_scores.update(player.name, player.score):
+            self._top_scores.schedule_store()
+            self._top_scores_changed = True
 
-        return render
+        player.snake.render_game_over(self._diff)
+        self.metrics.deaths.inc()
+        self._game_over_time += perf_counter() - start
 
-    async def player_disconnected(self, player):
+    async def player_disconnected(self, player, flush=True):
         logger.info('Removing %r', player)
         player.shutdown()
 
         if player.alive:
-            render = await self.game_over(player, force=True)
-            messages = self._apply_render(render)
-            await self._send_msg_all_multi(messages)
+            await self.game_over(player, force=True)
+            self._render_game_over_text()
+
+        if flush:
+            await self._flush()
+
+        if player.snake and self._players_by_owner.get(player.snake.owner) is player:
+            del self._players_by_owner[player.snake.owner]
 
         self._players.pop(player.id, None)
+        self._viewport_snapshots.discard(player)
         del player
 
     async def disconnect_closed(self):
         for player in list(self._players.values()):
             if player.is_connection_closed():
                 logger.warning('Disconnecting dead %r', player)
-                await self.player_disconnected(player)
+                await self.player_disconnected(player, flush=False)
+
+        await self._flush()
+
+        for spectators in self._spectators.values():
+            for connection in [c for c in spectators if c.closed or c.close_code]:
+                logger.warning('Disconnecting dead spectator %r', connection)
+                self.spectator_disconnected(connection)
 
     async def kill_all(self):
-        render = []
+        killed = False
 
         for player in self._players.values():
             if player.alive:
-                render += await self.game_over(player, force=True)
+                await self.game_over(player, force=True)
+                killed = True
 
-        messages = self._apply_render(render)
-        await self._send_msg_all_multi(messages)
+        if killed:
+            self._render_game_over_text()
+
+        await self._flush()
 
     async def shutdown(self, code=Messaging.WSCloseCode.GOING_AWAY, message='Server shutdown'):
         for player in list(self._players.values()):
             await self.close_player_connection(player, code=code, message=message)
 
+        for spectators in self._spectators.values():
+            for connection in list(spectators):
+                await self._close(connection, code=code, message=message)
+
+        await self._top_scores.flush()
+
+        if self.recorder:
+            await asyncio.get_event_loop().run_in_executor(None, self.recorder.close)
+
     async def next_frame(self):  # noqa: R701
+        frame_start = perf_counter()
+        self._game_over_time = 0.0
         self.frame += 1
         logger.debug('Rendering frame %d', self.frame)
-        # This list may change during iteration to change the order of figuring a player's move
-        # Sometimes a player's move depends on other player.
-        players = list(self._players.values())
-        messages = [[self.MSG_SYNC, self.frame, self.speed]]
-        render_all = Render()
+        self._broadcast(self.MSG_SYNC, self.frame, self.speed)
+        diff = self._diff
+        players = []
         new_players = []
-        frontal_crashers = set()
-        moves = {}
 
-        for player in players:
+        for player in self._players.values():
             if not player.alive:
                 continue
 
-            logger.debug('=> Rendering player %r', player)
-            # remember that a player was processed in this frame
-            first_player_loop = player.id not in moves
-
-            if first_player_loop:
-                moves[player.id] = 0
-
             # check if snake already exists
             if player.snake and len(player.snake.body):
-                # check next position's content
-                next_pos = player.snake.next_position()
+                players.append(player)
+            else:
+                new_players.append(player)
 
-                # check bounds
-                if self._world.is_invalid_position(next_pos):
-                    render_all += await self.game_over(player)
-                    continue
+        # all moves are resolved at once - the result does not depend on the order of players
+        moves = Moves(self._world, players, self.get_player_by_owner)
+        # kill points are not given to snakes crashing in the same frame (including frontal crashes)
+        for player, _, _ in moves.crashed:
+            player.alive = False
 
-                cur_ch = self._world[next_pos.y][next_pos.x]
-                next_ch = render_all.get(next_pos, None)
-                grow = 0
-                snake_crash = False  # hitting other living snake
-                dead_crash = False  # hitting other dead snake
-                tail_chase = False  # targeting a new void char
-                tail_crash = False  # hitting a tail for sure
-                own_tail_chaser = False
-
-                # special cases
-                if next_ch:  # check char already rendered in this frame
-                    if next_ch.char in Snake.DEAD_BODY_CHARS:
-                        dead_crash = True
-                        logger.debug('=> %r is going to hit a dying snake', player)
-                    elif next_ch.char == Snake.CH_HEAD and (cur_ch.char == World.CH_VOID or cur_ch.char.isdigit()):
-                        other_player = self.get_player_by_color(next_ch.color)
-                        assert other_player
-                        frontal_crashers.add(player)
-                        frontal_crashers.add(other_player)
-                        logger.debug('=> %r is going to frontally crash into %r', player, other_player)
-                    elif next_ch.char == Snake.CH_TAIL and cur_ch.char == Snake.CH_TAIL:
-                        tail_crash = True
-                        logger.debug('=> %r is going to hit %r snake\'s tail',
-                                     player, self.get_player_by_color(cur_ch.color))
-                    elif next_ch.char == World.CH_VOID and cur_ch.char == Snake.CH_TAIL:
-                        tail_chase = True
-                        logger.debug('=> %r is chasing %r\'s tail',
-                                     player, self.get_player_by_color(cur_ch.color))
-                    elif next_ch.char in Snake.BODY_CHARS:
-                        snake_crash = True
-                        logger.debug('=> %r is going to hit %r\'s snake',
-                                     player, self.get_player_by_color(cur_ch.color))
-                    else:
-                        logger.warning('=> Unexpected situation in the world ("%s") while rendering %r move',
-                                       next_ch, player)
-
-                # next move
-                if cur_ch.char.isdigit():  # yummy
-                    # start growing next turn in case we eaten a digit
-                    grow = int(cur_ch.char)
-                    player.score += grow
-                    logger.debug('=> %r ate the number "%s"', player, grow)
-                    messages.append([self.MSG_P_SCORE, player.id, player.score])
-
-                elif cur_ch.char == Snake.CH_TAIL and not tail_crash and not dead_crash:  # hitting someone's tail
-                    if cur_ch.color == player.color:
-                        other_player = player
-                        own_tail_chaser = True
-                        other_player_moved = False
-                    else:
-                        other_player = self.get_player_by_color(cur_ch.color)
-                        assert other_player
-                        other_player_moved = bool(moves.get(other_player.id, False))
-
-                    if ((not other_player_moved and other_player.snake.grow) or
-                            (other_player_moved and other_player.snake.grew)):
-                        # the tail won't move -> going to die anyway
-                        render_all += await self.game_over(player, ch_hit=cur_ch)
-                        continue
-                    elif own_tail_chaser:  # make move (follow tail) + skip old tail rendering
-                        logger.debug('=> %r is chasing his own tail', player)
-                    elif not tail_chase:  # wait if the other snake's tail moves
-                        logger.debug('=> %r\'s move postponed', player)
-                        assert first_player_loop, 'infinite loop'
-                        players.append(player)
-                        continue
-
-                elif cur_ch.char != World.CH_VOID and not tail_chase:
-                    if cur_ch.char in Snake.BODY_CHARS and cur_ch.color != player.color:
-                        # now the snake is going to hit another snake -> the situation depends on other snake's move
-                        other_player = self.get_player_by_color(cur_ch.color)
-                        assert other_player
-
-                        if other_player.id not in moves:  # wait for the other snake's move
-                            assert first_player_loop, 'infinite loop'
-                            logger.debug('=> %r\'s move postponed', player)
-                            players.append(player)
-                            continue
-
-                        if other_player.alive and cur_ch.char == Snake.CH_HEAD and not snake_crash:
-                            frontal_crashers.add(player)
-                            frontal_crashers.add(other_player)
-                            logger.debug('=> %r is frontally crashing into %r', player, other_player)
-                            continue
-
-                    render_all += await self.game_over(player, ch_hit=cur_ch)
-                    continue
+        for player in moves.frontal_crashers:
+            player.alive = False
 
-                logger.debug('=> %r moves to %s', player, next_pos)
-                render_all += player.snake.render_move(ignore_tail=own_tail_chaser)
-                player.snake.grow += grow
-                moves[player.id] += 1
+        for player, ch_hit, killer in moves.crashed:
+            await self.game_over(player, ch_hit=ch_hit, killer=killer)
 
-            else:
-                new_players.append(player)
+        for player, ch_hit in moves.moved:
+            grow = 0
+
+            if ch_hit.char.isdigit():  # yummy
+                # start growing next turn in case we eaten a digit
+                grow = int(ch_hit.char)
+                player.score += grow
+                logger.debug('=> %r ate the number "%s"', player, grow)
+                self._broadcast(self.MSG_P_SCORE, player.id, player.score)
+
+            logger.debug('=> %r moves to %s', player, player.snake.next_position())
+            # the old tail is not cleared if another snake (or the snake itself) is going to be there
+            player.snake.render_move(diff, ignore_tail=player in moves.tails_entered)
+            player.snake.grow += grow
+
+        moves_time = perf_counter() - frame_start - self._game_over_time
 
         # render game over for players that bumped into each other with their heads
-        for player in frontal_crashers:
-            render_all += await self.game_over(player, frontal_crash=True)
+        for player in moves.frontal_crashers:
+            await self.game_over(player, frontal_crash=True)
+
+        if moves.crashed or moves.frontal_crashers:
+            self._render_game_over_text()
 
         # render current snake moves -> update world before creating new digits and players
-        messages += self._apply_render(render_all.values())
-        render_all.clear()
+        start = perf_counter()
+        self._apply_render()
+        render_time = perf_counter() - start
 
         # spawn digits proportionally to the number of snakes alive
+        start = perf_counter()
+
         for _ in range(self.players_alive_count):
-            render_all += self.spawn_digit()
+            self.spawn_digit()
+
+        spawn_time = perf_counter() - start
 
         # new snakes are rendered last
+        start = perf_counter()
+        game_over_time = self._game_over_time
+
         for new_player in new_players:
             try:
                 # newborn snake
-                render_all += new_player.snake.render_new()
+                new_player.snake.render_new(diff)
             except SnakeError as exc:
                 logger.warning('%r snake cannot be created: %s', new_player, exc)
                 await self._send_msg(new_player, self.MSG_ERROR, str(exc))
-                render_all += await self.game_over(new_player)
+                await self.game_over(new_player)
+                self._render_game_over_text()
             else:
                 logger.info('%r was born', new_player)
                 # and it's birthday present
-                render_all += self.spawn_digit(right_now=True)  # FIXME: can be spawned over a new player
+                self.spawn_digit(right_now=True)
+
+        newborn_time = perf_counter() - start - (self._game_over_time - game_over_time)
 
         # render new digits and snakes -> update world before creating stones
-        messages += self._apply_render(render_all.values())
+        start = perf_counter()
+        self._apply_render()
+        render_time += perf_counter() - start
 
         # render stone
         if settings.STONES_ENABLED:
-            messages += self._apply_render(self.spawn_stone())
+            start = perf_counter()
+            self.spawn_stone()
+            spawn_time += perf_counter() - start
 
-        # send all messages
-        await self._send_msg_all_multi(messages)
+        if self.viewports:
+            self._move_viewports()
+
+            if not self.frame % settings.MINIMAP_INTERVAL:
+                self._outbox.append(self.viewports.update_minimap(self._players.values()))
+
+        # send everything produced in this frame as one message
+        start = perf_counter()
+        await self._flush()
+
+        if self.recorder:
+            self.recorder.end_frame(self.get_state_messages, self._world)
+
+        end = perf_counter()
+
+        self.metrics.observe_frame(end - frame_start, {
+            'moves': moves_time,
+            'game_over': self._game_over_time,
+            'render': render_time,
+            'spawn': spawn_time,
+            'newborn': newborn_time,
+            'broadcast': end - start,
+        })
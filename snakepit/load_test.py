@@ -0,0 +1,226 @@
+import random
+import asyncio
+from time import perf_counter
+from logging import getLogger
+from aiohttp import ClientSession, ClientError, TCPConnector, WSMsgType
+
+from .messaging import json, Messaging
+from .robot_player import DEFAULT_SERVER_URL
+from .utils import percentile
+
+logger = getLogger(__name__)
+
+KEY_CODES = (Messaging.CMD_LEFT, Messaging.CMD_UP, Messaging.CMD_RIGHT, Messaging.CMD_DOWN)
+
+
+class LoadClient(Messaging):
+    """
+    Synthetic websocket client which only records the arrival times of frames (MSG_SYNC).
+    """
+    def __init__(self, load_test, name, join=False, spectate=False):
+        self.load_test = load_test
+        self.name = name
+        self.join = join
+        self.spectate = spectate
+        self.connect_time = None
+        self.frames = 0
+        self.keys_sent = 0
+        self.bytes_received = 0
+        self.intervals = []
+        self.error = None
+        self.game = None
+        self._synced = False
+        self._last_sync = None
+
+    def __repr__(self):
+        return '<%s [name=%s] [frames=%d]>' % (self.__class__.__name__, self.name, self.frames)
+
+    def _parse(self, msg):
+        # return (sync, reset) where sync is (frame, speed) or None; binary frames are not decoded beyond the header
+        # and the trailer with non-render messages
+        sync = None
+
+        if msg.type == WSMsgType.BINARY:
+            data = msg.data
+            _, flags, frame, speed, num_runs = self.BINARY_HEADER.unpack_from(data)
+            offset = self.BINARY_HEADER.size + num_runs * self.BINARY_RUN.size
+
+            if flags & self.BINARY_FLAG_SYNC:
+                sync = (frame, speed)
+
+            if offset < len(data):
+                messages = json.loads(bytes(data[offset:]).decode('utf-8'))
+            else:
+                messages = ()
+        elif msg.type == WSMsgType.TEXT:
+            messages = json.loads(msg.data)
+
+            if isinstance(messages, list) and messages and not isinstance(messages[0], list):
+                messages = [messages]
+        else:
+            messages = ()
+
+        reset = False
+
+        for args in messages:
+            if args[0] == self.MSG_SYNC:
+                sync = (args[1], args[2])
+            elif args[0] == self.MSG_RESET_WORLD:
+                reset = True
+
+        return sync, reset
+
+    def _on_reset(self):
+        # frame numbers start from zero in every game
+        self.game += 1
+        self._last_sync = None
+        self.load_test.games = max(self.load_test.games, self.game)
+
+    def _on_sync(self, frame, speed, now):
+        if not self._synced:  # the first sync is sent with the handshake and repeats an already broadcasted frame
+            self._synced = True
+            return
+
+        if self._last_sync:
+            last_frame, last_time = self._last_sync
+
+            if frame == last_frame + 1:  # intervals are meaningful only between consecutive frames
+                interval = now - last_time
+                self.intervals.append(interval)
+                self.load_test.jitter.append(abs(interval - 1.0 / speed))
+
+        self._last_sync = (frame, now)
+        self.frames += 1
+        self.load_test.record_frame(self.game, frame, now)
+
+    async def _send_keys(self, ws, rate):
+        while not ws.closed:
+            await asyncio.sleep(random.expovariate(rate))
+
+            try:
+                await ws.send_str(str(random.choice(KEY_CODES)))
+            except ClientError:  # the connection is being closed
+                break
+
+            self.keys_sent += 1
+
+    async def run(self, session, server_url, protocol, key_rate):
+        start = perf_counter()
+        keys = None
+
+        try:
+            async with session.ws_connect(server_url) as ws:
+                if self.spectate:
+                    await ws.send_json([self.MSG_SPECTATE, protocol], dumps=json.dumps)
+                else:
+                    await ws.send_json([self.MSG_NEW_PLAYER, self.name, None, protocol], dumps=json.dumps)
+
+                if self.join:
+                    await ws.send_json([self.MSG_JOIN], dumps=json.dumps)
+
+                    if key_rate:
+                        keys = asyncio.ensure_future(self._send_keys(ws, key_rate))
+
+                async for msg in ws:
+                    now = perf_counter()
+
+                    if self.connect_time is None:  # the first message is the handshake
+                        self.connect_time = now - start
+                        self.game = self.load_test.games
+
+                    if msg.type == WSMsgType.ERROR:
+                        break
+
+                    if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                        self.bytes_received += len(msg.data)
+
+                    sync, reset = self._parse(msg)
+
+                    if reset:
+                        self._on_reset()
+
+                    if sync:
+                        self._on_sync(sync[0], sync[1], now)
+        except (ClientError, OSError, ValueError) as exc:
+            self.error = exc
+        finally:
+            if keys:
+                keys.cancel()
+
+
+class LoadTest:
+    """
+    Open many lightweight websocket clients to a game server and measure the frame delivery.
+    """
+    def __init__(self, clients, server_url=DEFAULT_SERVER_URL, protocol=Messaging.PROTOCOL_BINARY, players=0,
+                 connect_rate=100, key_rate=0, spectators=False):
+        self.server_url = server_url
+        self.protocol = protocol
+        self.connect_rate = connect_rate
+        self.key_rate = key_rate
+        # the first players clients join the game, the rest only watch (as idle players or as spectators)
+        self.clients = [LoadClient(self, 'load%d' % i, join=i < players, spectate=spectators and i >= players)
+                        for i in range(clients)]
+        self.jitter = []
+        self.games = 0  # number of games started since the first client connected
+        self._frame_arrivals = {}  # (game, frame) -> (first, last) arrival time
+
+    def __repr__(self):
+        return '<%s [clients=%d] [server=%s]>' % (self.__class__.__name__, len(self.clients), self.server_url)
+
+    def record_frame(self, game, frame, now):
+        key = (game, frame)
+        first_last = self._frame_arrivals.get(key, None)
+
+        if first_last:
+            self._frame_arrivals[key] = (first_last[0], now)
+        else:
+            self._frame_arrivals[key] = (now, now)
+
+    async def run(self, duration):
+        logger.info('Running %r for %s seconds', self, duration)
+        tasks = []
+        start = perf_counter()
+
+        async with ClientSession(connector=TCPConnector(limit=0)) as session:
+            for client in self.clients:
+                tasks.append(asyncio.ensure_future(client.run(session, self.server_url, self.protocol,
+                                                              self.key_rate)))
+                await asyncio.sleep(1.0 / self.connect_rate)
+
+            _, pending = await asyncio.wait(tasks, timeout=max(duration - (perf_counter() - start), 0.001))
+
+            for task in pending:
+                task.cancel()
+
+            if pending:
+                await asyncio.wait(pending)
+
+        return self.stats()
+
+    def stats(self):
+        clients = self.clients
+        connect_times = [c.connect_time for c in clients if c.connect_time is not None]
+        intervals = [i for c in clients for i in c.intervals]
+        # frames received by a single client only do not tell anything about the fan-out
+        skews = [last - first for first, last in self._frame_arrivals.values() if last > first]
+        stats = {
+            'clients': len(clients),
+            'connected': len(connect_times),
+            'errors': sum(1 for c in clients if c.error),
+            'frames': len(self._frame_arrivals),
+            'frames_received': sum(c.frames for c in clients),
+            'keys_sent': sum(c.keys_sent for c in clients),
+            'bytes_received': sum(c.bytes_received for c in clients),
+        }
+
+        for name, values in (('connect', connect_times), ('interval', intervals), ('jitter', self.jitter),
+                             ('skew', skews)):
+            stats[name] = {
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': max(values, default=0.0),
+            }
+
+        return stats
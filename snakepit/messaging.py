@@ -4,6 +4,9 @@ try:
 except ImportError:
     import json
 
+from collections import OrderedDict
+from struct import Struct
+
 from aiohttp import WSCloseCode
 
 
@@ -15,8 +18,11 @@ class Messaging:
 
     MSG_JOIN = 'join'
     MSG_NEW_PLAYER = 'new_player'
+    MSG_SPECTATE = 'spectate'
     MSG_HANDSHAKE = 'handshake'
     MSG_WORLD = 'world'
+    MSG_VIEWPORT = 'viewport'
+    MSG_MINIMAP = 'minimap'
     MSG_P_JOINED = 'p_joined'
     MSG_P_GAMEOVER = 'p_gameover'
     MSG_P_SCORE = 'p_score'
@@ -27,6 +33,17 @@ class Messaging:
     MSG_PING = 'ping'
     MSG_PONG = 'pong'
     MSG_SYNC = 'sync'
+    MSG_REDIRECT = 'redirect'
+
+    PROTOCOL_JSON = 'json'
+    PROTOCOL_BINARY = 'binary'
+    PROTOCOLS = frozenset([PROTOCOL_JSON, PROTOCOL_BINARY])
+
+    # Binary frame: header + runs of equal cells on one row + optional JSON list of other messages
+    BINARY_VERSION = 2
+    BINARY_FLAG_SYNC = 1
+    BINARY_HEADER = Struct('<BBIdI')  # version, flags, frame, speed, number of runs
+    BINARY_RUN = Struct('<HHHBHH')  # x, y, length, char, color, owner
 
     CMD_LEFT = 37
     CMD_UP = 38
@@ -34,18 +51,109 @@ class Messaging:
     CMD_DOWN = 40
 
     @staticmethod
-    async def _send_one(ws, message):
-        msg = json.dumps(message)
-        await ws.send_str(msg)
+    async def _send_one(connection, message):
+        connection.send(message, json.dumps(message))
 
-    @staticmethod
-    async def _send_all(wss, messages):
-        msg = json.dumps(messages)
+    @classmethod
+    def encode_binary(cls, messages):
+        flags = frame = speed = 0
+        runs = []
+        others = []
+        run = None
+
+        for msg in messages:
+            cmd = msg[0]
+
+            if cmd == cls.MSG_RENDER:
+                x, y, char, color, owner = msg[1:]
+
+                if (run and run[1] == y and run[0] + run[2] == x and run[3] == char and run[4] == color and
+                        run[5] == owner):
+                    run[2] += 1
+                else:
+                    run = [x, y, 1, char, color, owner]
+                    runs.append(run)
+            elif cmd == cls.MSG_SYNC:
+                flags |= cls.BINARY_FLAG_SYNC
+                frame, speed = msg[1], msg[2]
+            else:
+                others.append(msg)
+
+        header = cls.BINARY_HEADER.pack(cls.BINARY_VERSION, flags, frame, speed, len(runs))
+        pack_run = cls.BINARY_RUN.pack
+        body = b''.join(pack_run(x, y, length, ord(char), color, owner) for x, y, length, char, color, owner in runs)
+
+        if others:
+            trailer = json.dumps(others).encode('utf-8')
+        else:
+            trailer = b''
+
+        return header + body + trailer
+
+    @classmethod
+    def decode_binary(cls, data):
+        version, flags, frame, speed, num_runs = cls.BINARY_HEADER.unpack_from(data)
+
+        if version != cls.BINARY_VERSION:
+            raise ValueError('Unsupported binary frame version: %s' % version)
+
+        messages = []
+        renders = []
+        start = cls.BINARY_HEADER.size
+        offset = start + num_runs * cls.BINARY_RUN.size
+
+        if flags & cls.BINARY_FLAG_SYNC:
+            messages.append([cls.MSG_SYNC, frame, speed])
+
+        for x, y, length, char, color, owner in cls.BINARY_RUN.iter_unpack(data[start:offset]):
+            char = chr(char)
+
+            for i in range(x, x + length):
+                renders.append([cls.MSG_RENDER, i, y, char, color, owner])
+
+        if offset < len(data):
+            messages.extend(json.loads(bytes(data[offset:]).decode('utf-8')))
+
+        return messages + renders
+
+    @classmethod
+    def merge_messages(cls, messages):
+        # squash consecutive frames into one: the last sync and the last render of each cell win
+        sync = None
+        others = []
+        renders = OrderedDict()
+
+        for msg in messages:
+            cmd = msg[0]
+
+            if cmd == cls.MSG_RENDER:
+                key = (msg[1], msg[2])
+                renders.pop(key, None)
+                renders[key] = msg
+            elif cmd == cls.MSG_SYNC:
+                sync = msg
+            else:
+                if cmd in (cls.MSG_WORLD, cls.MSG_VIEWPORT, cls.MSG_RESET_WORLD):
+                    renders.clear()
+
+                others.append(msg)
+
+        if sync:
+            others.insert(0, sync)
+
+        return others + list(renders.values())
+
+    @classmethod
+    async def _send_all(cls, connections, messages, protocol=PROTOCOL_JSON):
+        if protocol == cls.PROTOCOL_BINARY:
+            msg = cls.encode_binary(messages)
+        else:
+            msg = json.dumps(messages)
 
-        for ws in wss:
-            if not ws.closed:
-                await ws.send_str(msg)
+        for connection in connections:
+            if not connection.closed:
+                connection.send(messages, msg)
 
     @staticmethod
-    async def _close(ws, code=WSCloseCode.GOING_AWAY, message='Closing connection'):
-        await ws.close(code=code, message=message)
+    async def _close(connection, code=WSCloseCode.GOING_AWAY, message='Closing connection'):
+        await connection.close(code=code, message=message)
@@ -0,0 +1,223 @@
+from bisect import bisect_left
+from math import isinf
+
+
+def _format_value(value):
+    if isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+
+    labels = ('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+              for name, value in zip(names, values))
+
+    return '{' + ','.join(labels) + '}'
+
+
+class Metric:
+    """
+    Minimal Prometheus-style metric with optional labels.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+
+    def __repr__(self):
+        return '<%s [name=%s]>' % (self.__class__.__name__, self.name)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        assert len(values) == len(self.label_names), 'wrong number of label values'
+
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self._children[values] = self._new_child()
+            return child
+
+    def remove(self, *values):
+        # remove all children whose label values start with the given values
+        n = len(values)
+
+        for key in [key for key in self._children if key[:n] == values]:
+            del self._children[key]
+
+    def _samples(self, values, child):
+        yield self.name, self.label_names, values, child.value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.TYPE)]
+
+        for values, child in sorted(self._children.items()):
+            for name, label_names, label_values, value in self._samples(values, child):
+                lines.append('%s%s %s' % (name, _format_labels(label_names, label_values), _format_value(value)))
+
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels=labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _samples(self, values, child):
+        bucket_labels = self.label_names + ('le',)
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            yield self.name + '_bucket', bucket_labels, values + (_format_value(bound),), cumulative
+
+        yield self.name + '_sum', self.label_names, values, child.sum
+        yield self.name + '_count', self.label_names, values, child.count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def remove(self, *values):
+        for metric in self._metrics:
+            metric.remove(*values)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+FRAME_PHASES = ('moves', 'game_over', 'render', 'spawn', 'newborn', 'broadcast')
+
+FRAME_SECONDS = REGISTRY.register(Histogram(
+    'snakepit_frame_seconds', 'Time spent rendering a whole frame', labels=('room',)))
+FRAME_PHASE_SECONDS = REGISTRY.register(Histogram(
+    'snakepit_frame_phase_seconds', 'Time spent in each phase of a frame', labels=('room', 'phase')))
+FRAME_LATENESS_SECONDS = REGISTRY.register(Histogram(
+    'snakepit_frame_lateness_seconds', 'Delay between the scheduled and actual start of a frame', labels=('room',)))
+FRAMES = REGISTRY.register(Counter(
+    'snakepit_frames_total', 'Number of rendered frames', labels=('room',)))
+DEATHS = REGISTRY.register(Counter(
+    'snakepit_deaths_total', 'Number of dead snakes', labels=('room',)))
+SPAWNS = REGISTRY.register(Counter(
+    'snakepit_spawns_total', 'Number of spawned digits and stones', labels=('room', 'kind')))
+MESSAGES_SENT = REGISTRY.register(Counter(
+    'snakepit_messages_sent_total', 'Number of messages queued for sending to websocket connections',
+    labels=('room',)))
+PLAYERS = REGISTRY.register(Gauge(
+    'snakepit_players', 'Number of connected players', labels=('room',)))
+SPECTATORS = REGISTRY.register(Gauge(
+    'snakepit_spectators', 'Number of connected spectators', labels=('room',)))
+PLAYERS_ALIVE = REGISTRY.register(Gauge(
+    'snakepit_players_alive', 'Number of players with a living snake', labels=('room',)))
+SEND_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'snakepit_send_queue_depth', 'Number of messages waiting in websocket send queues', labels=('room',)))
+SEND_QUEUE_DROPPED = REGISTRY.register(Gauge(
+    'snakepit_send_queue_dropped', 'Number of messages dropped by current websocket connections', labels=('room',)))
+FRAME_OVERRUNS = REGISTRY.register(Gauge(
+    'snakepit_frame_overruns', 'Number of frames which started late', labels=('room',)))
+FRAME_RATE = REGISTRY.register(Gauge(
+    'snakepit_frame_rate', 'Measured number of frames per second', labels=('room',)))
+
+
+class GameMetrics:
+    """
+    Metric children of one game room (looked up once to keep the per-frame overhead low).
+    """
+    def __init__(self, room):
+        self.room = room
+        self.frame_seconds = FRAME_SECONDS.labels(room)
+        self.phase_seconds = {phase: FRAME_PHASE_SECONDS.labels(room, phase) for phase in FRAME_PHASES}
+        self.frame_lateness = FRAME_LATENESS_SECONDS.labels(room)
+        self.frames = FRAMES.labels(room)
+        self.deaths = DEATHS.labels(room)
+        self.digit_spawns = SPAWNS.labels(room, 'digit')
+        self.stone_spawns = SPAWNS.labels(room, 'stone')
+        self.messages_sent = MESSAGES_SENT.labels(room)
+
+    def __repr__(self):
+        return '<%s [room=%s]>' % (self.__class__.__name__, self.room)
+
+    def observe_frame(self, total, phases):
+        self.frame_seconds.observe(total)
+        self.frames.inc()
+
+        for phase, seconds in phases.items():
+            self.phase_seconds[phase].observe(seconds)
+
+    def update(self, game):
+        # gauges are collected when the metrics are requested
+        room = self.room
+        queue_stats = game.send_queue_stats()
+        PLAYERS.labels(room).set(game.players_count)
+        PLAYERS_ALIVE.labels(room).set(game.players_alive_count)
+        SPECTATORS.labels(room).set(game.spectators_count)
+        SEND_QUEUE_DEPTH.labels(room).set(queue_stats['queue_depth'])
+        SEND_QUEUE_DROPPED.labels(room).set(queue_stats['dropped'])
+        FRAME_OVERRUNS.labels(room).set(game.scheduler.overruns)
+        FRAME_RATE.labels(room).set(game.scheduler.fps)
+
+    def remove(self):
+        REGISTRY.remove(self.room)
@@ -0,0 +1,158 @@
+from logging import getLogger
+
+from .datatypes import Char
+from .snake import Snake
+from .world import World
+
+logger = getLogger(__name__)
+
+# move outcomes
+MOVE = 1  # the snake moves (it can still die in a head-on crash with another snake moving into the same cell)
+STAY = 2  # the snake does not move and dies in a head-on crash
+CRASH = 3  # the snake does not move and dies
+
+# dependencies between snakes
+TAIL = 1  # targeting other snake's tail
+HEAD = 2  # targeting other snake's head
+
+
+class Moves:
+    """
+    Simultaneous moves of all living snakes in one frame resolved in a single pass.
+
+    Every snake targets one cell. A snake targeting a free cell or a digit moves. A snake targeting another snake's
+    tail depends on that snake - it moves only if the tail moves away. A snake targeting another snake's head dies
+    (the head becomes body) or, if the other snake does not move either, both die in a head-on crash. Since every
+    snake depends on at most one other snake, the dependencies form chains ending in a snake with a fixed outcome or
+    in a cycle. Cycles of snakes chasing each other's tails move together, cycles of heads crash together and mixed
+    cycles cannot move at all. Snakes moving into the same cell die in a head-on crash after moving.
+    """
+    def __init__(self, world, players, get_player_by_owner):
+        # players with a living snake placed in the world
+        self.players = players
+        self.moved = []  # (player, character in the target cell) of snakes which move
+        self.crashed = []  # (player, character hit, owner of the character hit) of snakes which die without moving
+        self.frontal_crashers = []  # players dying in head-on crashes
+        self.tails_entered = set()  # players whose old tail is entered by a moving snake
+        self._resolve(world, get_player_by_owner)
+
+    def __repr__(self):
+        return '<%s [moved=%d] [crashed=%d] [frontal=%d]>' % (self.__class__.__name__, len(self.moved),
+                                                               len(self.crashed), len(self.frontal_crashers))
+
+    def _resolve(self, world, get_player_by_owner):  # noqa: R701
+        players = self.players
+        n = len(players)
+        index = {player: i for i, player in enumerate(players)}
+        outcomes = [None] * n
+        targets = [None] * n  # target position index in the world
+        hits = [None] * n  # character in the target cell
+        owners = [None] * n  # living snake in the target cell
+        edges = [None] * n  # (dependency, index of the other snake)
+        frontal = [False] * n
+
+        for i, player in enumerate(players):
+            snake = player.snake
+            target = targets[i] = snake.next_cell()
+
+            if target < 0:  # outside of the world
+                outcomes[i] = CRASH
+                continue
+
+            char = world.get_char(target)
+            hits[i] = Char(char, world.get_color(target))
+
+            if char == World.CH_VOID or char.isdigit():
+                outcomes[i] = MOVE
+            elif char in Snake.BODY_CHARS:
+                other = owners[i] = get_player_by_owner(world.get_owner(target))
+                j = index.get(other, None)
+
+                if j is None:  # not a living snake (should not happen)
+                    outcomes[i] = CRASH
+                elif j == i:  # own tail moves away unless growing, own body does not
+                    outcomes[i] = MOVE if char == Snake.CH_TAIL and not snake.grow else CRASH
+                elif char == Snake.CH_TAIL:
+                    edges[i] = (TAIL, j)
+                elif char == Snake.CH_HEAD:
+                    edges[i] = (HEAD, j)
+                else:
+                    outcomes[i] = CRASH
+            else:  # stone or dead snake
+                outcomes[i] = CRASH
+
+        visiting = [-1] * n  # position in the current dependency chain
+
+        for start in range(n):
+            if outcomes[start] is not None:
+                continue
+
+            chain = []
+            i = start
+
+            while outcomes[i] is None and visiting[i] < 0:
+                visiting[i] = len(chain)
+                chain.append(i)
+                i = edges[i][1]
+
+            if outcomes[i] is None:  # cycle from i to the end of the chain
+                cycle = chain[visiting[i]:]
+                del chain[visiting[i]:]
+                dependencies = {edges[j][0] for j in cycle}
+
+                if dependencies == {TAIL} and not any(players[edges[j][1]].snake.grow for j in cycle):
+                    outcome = MOVE
+                elif dependencies == {HEAD}:
+                    outcome = STAY
+                else:
+                    outcome = CRASH
+
+                for j in cycle:
+                    outcomes[j] = outcome
+                    frontal[j] = outcome == STAY
+
+            # the rest of the chain depends on already resolved snakes
+            for j in reversed(chain):
+                dependency, k = edges[j]
+                other = outcomes[k]
+
+                if dependency == TAIL:
+                    if other == MOVE and not players[k].snake.grow:
+                        outcomes[j] = MOVE
+                    else:
+                        outcomes[j] = CRASH
+                elif other == STAY:  # HEAD
+                    outcomes[j] = STAY
+                    frontal[j] = frontal[k] = True
+                else:
+                    outcomes[j] = CRASH
+
+            for j in chain:
+                visiting[j] = -1
+
+        # snakes moving into the same cell crash
+        movers = {}
+
+        for i in range(n):
+            if outcomes[i] == MOVE:
+                movers.setdefault(targets[i], []).append(i)
+
+        for i in range(n):
+            player = players[i]
+            outcome = outcomes[i]
+
+            if outcome == MOVE:
+                self.moved.append((player, hits[i]))
+
+                if len(movers[targets[i]]) > 1:
+                    frontal[i] = True
+
+                if hits[i].char == Snake.CH_TAIL:
+                    self.tails_entered.add(owners[i])
+            elif outcome == CRASH:
+                self.crashed.append((player, hits[i], owners[i]))
+
+            if frontal[i]:
+                self.frontal_crashers.append(player)
+
+        logger.debug('Resolved %r', self)
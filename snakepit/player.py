@@ -8,8 +8,9 @@ logger = getLogger(__name__)
 
 class Player:
     snake = None
+    viewport = None  # top left corner of the visible part of the world (see Viewports)
 
-    def __init__(self, player_id, name, ws):
+    def __init__(self, player_id, name, connection):
         self.id = player_id
         self.name = name
         self.wss = []
@@ -20,22 +21,25 @@ class Player:
             Messaging.CMD_RIGHT: Snake.RIGHT,
             Messaging.CMD_DOWN: Snake.DOWN,
         }
-        self.add_connection(ws)
+        self.add_connection(connection)
 
     def __repr__(self):
         return '<%s [id=%s] [name=%s] [color=%s]>' % (self.__class__.__name__, str(self.id)[:8], self.name, self.color)
 
-    def add_connection(self, ws):
-        self.wss.append(ws)
+    def add_connection(self, connection):
+        self.wss.append(connection)
 
     def shutdown(self):
+        for connection in self.wss:
+            connection.shutdown()
+
         self.wss.clear()
 
     def is_connection_closed(self):
         return any(ws.closed or ws.close_code for ws in self.wss)
 
-    def new_snake(self, game_settings, world, color):
-        self.snake = Snake(game_settings, world, color)
+    def new_snake(self, game_settings, world, color, owner=0):
+        self.snake = Snake(game_settings, world, color, owner=owner)
 
     def keypress(self, code):
         if not self.alive:
@@ -0,0 +1,181 @@
+import os
+import mmap
+import zlib
+import queue
+import threading
+from time import strftime
+from bisect import bisect_right
+from struct import Struct
+from logging import getLogger
+
+from . import settings
+from .world import World
+from .messaging import json, Messaging
+
+logger = getLogger(__name__)
+
+LOG_EXT = '.replay'
+INDEX_EXT = '.replay.idx'
+
+RECORD_FRAME = 1
+RECORD_KEYFRAME = 2
+RECORD_HEADER = Struct('<BII')  # record type, frame sequence number, size of the compressed data
+INDEX_ENTRY = Struct('<IQ')  # keyframe sequence number, offset of the keyframe record in the log
+
+
+class ReplayRecorder:
+    """
+    Append-only log of all messages broadcasted in a game room written by a background thread.
+
+    The log is one raw deflate stream split into records - one per frame. Each record holds a list of message
+    batches (one batch per broadcast). Every keyframe_interval frames a keyframe record with the full world state
+    follows the frame record; the compressor is fully flushed before it, so decompression can start at any keyframe.
+    Keyframe offsets are stored in a separate index file.
+    """
+    def __init__(self, path, keyframe_interval=settings.REPLAY_KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.frames = 0  # frame sequence number; unlike the game frame, it does not restart with every game
+        self.failed = False  # the writer has stopped because of an error; nothing is recorded anymore
+        self._batches = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write, name='replay-recorder', daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return '<%s [path=%s] [frames=%d]>' % (self.__class__.__name__, self.path, self.frames)
+
+    @classmethod
+    def create(cls, directory, room, **kwargs):
+        # new recording named after the room and current time
+        os.makedirs(directory, exist_ok=True)
+        name = base_name = '%s-%s' % (room, strftime('%Y%m%d-%H%M%S'))
+        i = 0
+
+        while os.path.exists(os.path.join(directory, name + LOG_EXT)):
+            i += 1
+            name = '%s-%d' % (base_name, i)
+
+        logger.info('Recording room "%s" into replay "%s"', room, name)
+
+        return cls(os.path.join(directory, name), **kwargs)
+
+    def add(self, messages):
+        # called for every broadcast; the messages must not be changed afterwards
+        if not self.failed:
+            self._batches.append(messages)
+
+    def end_frame(self, get_state, world):
+        # called after every frame; get_state() returns a list of messages describing the game (except the world)
+        if self.failed:
+            return
+
+        self.frames += 1
+        batches, self._batches = self._batches, []
+
+        if self.frames % self.keyframe_interval:
+            keyframe = None
+        else:
+            keyframe = (get_state(), world.dump())
+
+        self._queue.put((self.frames, batches, keyframe))
+
+    def close(self):
+        # blocks until all records are written
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _write(self):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)  # raw stream
+        world = World()
+
+        try:
+            with open(self.path + LOG_EXT, 'xb') as log, open(self.path + INDEX_EXT, 'xb') as index:
+                offset = 0
+
+                while True:
+                    item = self._queue.get()
+
+                    if item is None:  # closed
+                        break
+
+                    seq, batches, keyframe = item
+                    flush_mode = zlib.Z_FULL_FLUSH if keyframe else zlib.Z_SYNC_FLUSH
+                    data = compressor.compress(json.dumps(batches).encode('utf-8')) + compressor.flush(flush_mode)
+                    log.write(RECORD_HEADER.pack(RECORD_FRAME, seq, len(data)) + data)
+                    offset += RECORD_HEADER.size + len(data)
+
+                    if keyframe:
+                        state, world_data = keyframe
+                        world.restore(*world_data)
+                        messages = state + [[Messaging.MSG_WORLD, world.snapshot()]]
+                        data = compressor.compress(json.dumps([messages]).encode('utf-8'))
+                        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                        log.write(RECORD_HEADER.pack(RECORD_KEYFRAME, seq, len(data)) + data)
+                        log.flush()
+                        # the index never points to an incomplete record
+                        index.write(INDEX_ENTRY.pack(seq, offset))
+                        index.flush()
+                        offset += RECORD_HEADER.size + len(data)
+        except Exception as exc:
+            logger.exception('Replay recording %s failed: %r', self.path, exc)
+            self.failed = True
+
+            # frames queued in the meantime would never be written
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+
+class ReplayReader:
+    """
+    Memory-mapped replay log.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path + LOG_EXT, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size:
+                self._data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = b''
+
+        try:
+            with open(path + INDEX_EXT, 'rb') as fp:
+                index = fp.read()
+        except FileNotFoundError:
+            index = b''
+
+        # the recording can be still in progress -> ignore incomplete index entries
+        entries = [INDEX_ENTRY.unpack_from(index, i)
+                   for i in range(0, len(index) - len(index) % INDEX_ENTRY.size, INDEX_ENTRY.size)]
+        self._keyframes = [seq for seq, _ in entries]
+        self._offsets = [offset for _, offset in entries]
+
+    def __repr__(self):
+        return '<%s [path=%s] [keyframes=%d]>' % (self.__class__.__name__, self.path, len(self._keyframes))
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def records(self, start=0):
+        # yield (record type, frame sequence number, message batches) starting with the last keyframe before the
+        # start frame (or with the first frame)
+        i = bisect_right(self._keyframes, start) - 1
+        offset = self._offsets[i] if i >= 0 else 0
+        data = self._data
+        size = len(data)
+        decompressor = zlib.decompressobj(-15)
+
+        while offset + RECORD_HEADER.size <= size:
+            record_type, seq, length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+
+            if offset + length > size:  # incomplete record
+                break
+
+            batches = json.loads(decompressor.decompress(data[offset:offset + length]).decode('utf-8'))
+            offset += length
+
+            yield record_type, seq, batches
@@ -1,14 +1,16 @@
 import asyncio
 import signal
-from time import time
+from time import time, perf_counter
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from aiohttp import ClientSession, WSMsgType
+from aiohttp import ClientSession, ClientError, WSMsgType
 
 from . import settings
 from .world import World
-from .datatypes import Char
 from .messaging import json, Messaging
 from .robot_snake import RobotSnake
+from .snake_index import SnakeIndex
+from .utils import percentile
 
 logger = getLogger(__name__)
 
@@ -18,12 +20,24 @@ DEFAULT_SERVER_URL = 'http://localhost:%d/connect' % settings.SERVER_PORT
 class RobotPlayer(Messaging):
     DEFAULT_SNAKE_CLASS = RobotSnake
     ping_pong_enabled = False
-
-    def __init__(self, name, player_id=None, snake_class=None, server_url=DEFAULT_SERVER_URL):
-        self._first_render_sent = False
+    protocol = Messaging.PROTOCOL_BINARY
+    _executor = None  # worker threads running decisions with a budget; shared by all robot players in the process
+
+    def __init__(self, name, player_id=None, snake_class=None, server_url=DEFAULT_SERVER_URL,
+                 decision_budget=settings.ROBOT_DECISION_BUDGET):
+        self._started = False
+        self._initial = False
+        self._decision = None
         self._last_ping = None
         self._ws = None
+        self._redirected = False
         self.frame = 0
+        self.frames_received = 0
+        self.frames_skipped = 0
+        self.score = 0
+        self.decision_budget = decision_budget
+        self.decision_times = []
+        self.decision_misses = 0
         self.speed = 0
         self.latency = 0
         self.loop = None
@@ -31,7 +45,8 @@ class RobotPlayer(Messaging):
         self.name = name
         self.server_url = server_url
         self.id = player_id
-        self.world = World()
+        self.world = World(track_owners=True)
+        self.snakes = SnakeIndex()
         self.players = {}
         self.top_scores = []
         self.keymap = {
@@ -45,44 +60,62 @@ class RobotPlayer(Messaging):
             snake_class = self.DEFAULT_SNAKE_CLASS
 
         self.snake = snake_class({}, self.world, None)
+        self.snake._snakes = self.snakes
 
     def __repr__(self):
         return '<%s [id=%s] [name=%s] [color=%s]>' % (self.__class__.__name__, str(self.id)[:8], self.name,
                                                       self.snake.color)
 
     def _handle_ws_message(self, data):  # noqa: R701
-        tick = start = stop = False
+        # data contains messages of one or more frames; all are applied to the world, but the robot snake decides
+        # only once - on the newest frame
+        world = self.world
+        snakes = self.snakes
+        size_x = world.SIZE_X
+        frames = 0
+        stop = False
 
         for args in data:
             cmd = args[0]
 
-            if cmd == self.MSG_PONG:
+            if cmd == self.MSG_RENDER:
+                x, y, char, color, owner = args[1], args[2], args[3], args[4], args[5]
+                snakes.update(x, y, char, color, owner)
+                world.set_cell(y * size_x + x, char, color, owner)
+            elif cmd == self.MSG_SYNC:
+                self.frame = args[1]
+                self.speed = args[2]
+                frames += 1
+            elif cmd == self.MSG_PONG:
                 if self._last_ping == args[1]:
                     # noinspection PyTypeChecker
                     self.latency = time() * 1000 - self._last_ping
                     self._last_ping = None
                     logger.debug('Current latency: %s ms', round(self.latency, 2))
-            elif cmd == self.MSG_SYNC:
-                self.frame = args[1]
-                self.speed = args[2]
-            elif cmd == self.MSG_RENDER:
-                x, y = args[1], args[2]
-                self.world[y][x] = Char(args[3], args[4])
-
-                if self._first_render_sent:
-                    tick = True
-                else:
-                    self._first_render_sent = start = True
             elif cmd == self.MSG_HANDSHAKE:
                 self.name = args[1]
                 self.id = args[2]
                 self.snake._game_settings = args[3]
             elif cmd == self.MSG_RESET_WORLD:
-                self.world.reset()
+                world.reset()
+                snakes.clear()
             elif cmd == self.MSG_ERROR:
                 raise SystemError(args[1])
+            elif cmd == self.MSG_REDIRECT:
+                # the cluster's matchmaker has chosen a game server and room for us
+                self.server_url = args[1]
+                self.id = args[2]
+                self._redirected = True
+                return False
             elif cmd == self.MSG_WORLD:
-                self.world.load(args[1])
+                world.load(args[1])
+                snakes.load(world)
+            elif cmd == self.MSG_VIEWPORT:
+                # the rest of the world is unknown; the viewport's cells are rendered by the following messages
+                world.reset()
+                snakes.clear()
+            elif cmd == self.MSG_MINIMAP:
+                pass
             elif cmd == self.MSG_P_JOINED:
                 player_id = args[1]
                 logger.info('New player: %s', args)
@@ -90,6 +123,7 @@ class RobotPlayer(Messaging):
 
                 if player_id == self.id:
                     self.snake.color = args[3]
+                    self.snake.owner = args[5]
             elif cmd == self.MSG_P_GAMEOVER:
                 player_id = args[1]
                 logger.info('Game over for player: %s', self.players.pop(player_id, None))
@@ -101,27 +135,43 @@ class RobotPlayer(Messaging):
 
                 if player_id in self.players:
                     self.players[player_id][3] = args[2]
+
+                if player_id == self.id:
+                    self.score = args[2]
             elif cmd == self.MSG_TOP_SCORES:
                 self.top_scores[:] = args[1]
             else:
                 logger.warning('Unknown message: %s', args)
 
-        if tick or stop or start:
-            response_msg = self.tick(start=start, stop=stop)
+        self.frames_received += frames
 
-            if stop:
-                raise RuntimeError('Game over')
-        else:
-            response_msg = None
+        if frames > 1:
+            self.frames_skipped += frames - 1
+            logger.debug('Skipped %d frame(s)', frames - 1)
 
-        return response_msg
+        if stop:
+            self.tick(stop=True)
+            raise RuntimeError('Game over')
+
+        if not frames:
+            return False
+
+        if not self._started and self.snake.owner in snakes:  # our snake is in the world
+            self._started = self._initial = True
+
+        return self._started
 
     async def ping_pong(self):
         while True:
-            if self._ws and not self._last_ping:
+            if self._ws and not self._ws.closed and not self._last_ping:
                 now = time() * 1000
-                await self._ws.send_json([Messaging.MSG_PING, now, self.latency], dumps=json.dumps)
-                self._last_ping = now
+
+                try:
+                    await self._ws.send_json([Messaging.MSG_PING, now, self.latency], dumps=json.dumps)
+                except ClientError as exc:  # the connection is being closed
+                    logger.debug('Cannot send ping: %r', exc)
+                else:
+                    self._last_ping = now
 
             if self.running:
                 try:
@@ -131,45 +181,117 @@ class RobotPlayer(Messaging):
             else:
                 break
 
-    async def ws_session(self):
-        async with ClientSession() as session:
-            async with session.ws_connect(self.server_url) as ws:
-                await ws.send_json([self.MSG_NEW_PLAYER, self.name, self.id], dumps=json.dumps)
-                await ws.send_json([self.MSG_JOIN], dumps=json.dumps)
-                self._ws = ws
-
-                async for msg in ws:
-                    if msg.type == WSMsgType.TEXT:
-                        logger.debug('Got message: %s', msg.data)
-                        data = json.loads(msg.data)
-
-                        if not isinstance(data, list) or len(data) < 1:
-                            logger.error('Invalid data: %s', data)
-                            break
-
-                        if not isinstance(data[0], list):
-                            data = [data]
-
-                        try:
-                            response_msg = self._handle_ws_message(data)
-                        except RuntimeError as exc:
-                            logger.info('%s', exc)
-                            break
-                        else:
-                            if response_msg:
-                                logger.info('Sending message: %s', response_msg)
-                                await ws.send_json(response_msg, dumps=json.dumps)
-
-                    elif msg.type == WSMsgType.CLOSED:
-                        logger.info('Connection closed')
-                        break
-                    elif msg.type == WSMsgType.ERROR:
-                        raise SystemError('Connection error')
-                    else:
-                        logger.warning('Unknown message type: %s', msg.type)
-
-            self._ws = None
-            logger.warning('Connection closed')
+    @staticmethod
+    async def _ws_reader(ws, queue):
+        try:
+            async for msg in ws:
+                queue.put_nowait(msg)
+        finally:
+            queue.put_nowait(None)
+
+    def _decode_ws_message(self, msg):
+        if msg.type == WSMsgType.BINARY:
+            data = self.decode_binary(msg.data)
+        elif msg.type == WSMsgType.TEXT:
+            data = json.loads(msg.data)
+        elif msg.type == WSMsgType.ERROR:
+            raise SystemError('Connection error')
+        else:
+            logger.warning('Unknown message type: %s', msg.type)
+            return []
+
+        logger.debug('Got message: %s', msg.data)
+
+        if not isinstance(data, list) or len(data) < 1:
+            raise ValueError('Invalid data: %s' % data)
+
+        if not isinstance(data[0], list):
+            data = [data]
+
+        return data
+
+    async def ws_session(self, session=None):
+        # the client session (HTTP connection pool) can be shared by many robot players running in one event loop
+        if session is None:
+            async with ClientSession() as session:
+                return await self.ws_session(session=session)
+
+        async with session.ws_connect(self.server_url) as ws:
+            await ws.send_json([self.MSG_NEW_PLAYER, self.name, self.id, self.protocol], dumps=json.dumps)
+            await ws.send_json([self.MSG_JOIN], dumps=json.dumps)
+            self._ws = ws
+            # messages are received in the background so that a slow robot can catch up by processing all
+            # queued frames at once
+            queue = asyncio.Queue()
+            reader = asyncio.ensure_future(self._ws_reader(ws, queue))
+
+            try:
+                await self._process_ws_messages(ws, queue)
+            finally:
+                reader.cancel()
+
+        self._ws = None
+
+        if self._redirected:
+            self._redirected = False
+            logger.info('Redirected to %s', self.server_url)
+            return await self.ws_session(session=session)
+
+        logger.warning('Connection closed')
+
+    async def _process_ws_messages(self, ws, queue):
+        closed = False
+
+        while not closed:
+            messages = [await queue.get()]
+            received = perf_counter()
+
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+
+            data = []
+
+            for msg in messages:
+                if msg is None:
+                    logger.info('Connection closed')
+                    closed = True
+                    break
+
+                try:
+                    data.extend(self._decode_ws_message(msg))
+                except ValueError as exc:
+                    logger.error('%s', exc)
+                    return
+
+            late_decision = self._decision
+
+            if late_decision:
+                # the late decision is still reading the world - newer frames are applied after it has finished
+                await asyncio.wait([late_decision])
+
+            try:
+                decide = self._handle_ws_message(data)
+            except RuntimeError as exc:
+                logger.info('%s', exc)
+                return
+
+            if self._redirected:
+                return
+
+            if decide and late_decision:
+                # the time of this frame was used by the late decision
+                self.decision_misses += 1
+                logger.warning('Frame %s missed: previous decision was still running', self.frame)
+                decide = False
+
+            if decide:
+                response_msg = await self.decide(received)
+            else:
+                response_msg = None
+
+            if response_msg and not closed:
+                logger.info('Sending message: %s', response_msg)
+                await ws.send_json(response_msg, dumps=json.dumps)
 
     def run(self):
         if self.running:
@@ -193,6 +315,7 @@ class RobotPlayer(Messaging):
         except asyncio.CancelledError:
             pass
         finally:
+            logger.info('Decision stats of %r: %s', self, self.decision_stats())
             self.stop()
             self.running = False
 
@@ -200,12 +323,81 @@ class RobotPlayer(Messaging):
         if self.running and self.loop:
             logger.warning('Stopping %r', self)
 
-            for task in asyncio.Task.all_tasks():
+            for task in asyncio.all_tasks(self.loop):
                 task.cancel()
 
+            self.shutdown_executor()
             self.on_loop_stop()
             self.loop.stop()
 
+    @classmethod
+    def get_executor(cls):
+        if not RobotPlayer._executor:
+            RobotPlayer._executor = ThreadPoolExecutor(thread_name_prefix='robot-decision')
+
+        return RobotPlayer._executor
+
+    @classmethod
+    def shutdown_executor(cls):
+        if RobotPlayer._executor:
+            RobotPlayer._executor.shutdown(wait=False)
+            RobotPlayer._executor = None
+
+    def _timed_tick(self, start):
+        started = perf_counter()
+
+        try:
+            return self.tick(start=start)
+        finally:
+            self.decision_times.append(perf_counter() - started)
+
+    def _late_decision_done(self, future):
+        self._decision = None
+
+        if not future.cancelled() and future.exception():
+            logger.error('Late decision failed: %r', future.exception())
+
+    async def decide(self, received):
+        # ask the robot snake for a direction; with a decision budget the snake runs in a worker thread and
+        # its answer must arrive before the budget (a fraction of the current frame interval) runs out
+        initial, self._initial = self._initial, False
+
+        if not self.decision_budget or not self.speed:
+            return self._timed_tick(initial)
+
+        budget = self.decision_budget / self.speed - (perf_counter() - received)
+        future = asyncio.get_event_loop().run_in_executor(self.get_executor(), self._timed_tick, initial)
+        done, _ = await asyncio.wait([future], timeout=max(budget, 0))
+
+        if done:
+            return future.result()
+
+        # keep the current direction and discard the late answer; newer frames are not applied to the world until
+        # the late decision has finished (see _process_ws_messages())
+        self.decision_misses += 1
+        logger.warning('Frame %s missed: decision took longer than %.1f ms', self.frame, budget * 1000)
+        self._decision = future
+        future.add_done_callback(self._late_decision_done)
+
+        return None
+
+    def decision_stats(self):
+        times = self.decision_times
+
+        return {
+            'decisions': len(times),
+            'misses': self.decision_misses,
+            'frames_skipped': self.frames_skipped,
+            'decision_p50': percentile(times, 50),
+            'decision_p90': percentile(times, 90),
+            'decision_p99': percentile(times, 99),
+            'decision_max': max(times, default=0.0),
+        }
+
+    def summary(self):
+        return dict(self.decision_stats(), name=self.name, robot=self.snake.__class__.__name__,
+                    frames=self.frames_received, latency=self.latency, score=self.score)
+
     def tick(self, start=False, stop=False):
         response_msg = None
 
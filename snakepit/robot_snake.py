@@ -1,13 +1,29 @@
 import random
 
 from .snake import BaseSnake
+from .snake_index import SnakeIndex
 
 
 class RobotSnake(BaseSnake):
+    _snakes = None  # SnakeIndex kept up to date by the robot player
+
     @property
     def world(self):
         return self._world
 
+    @property
+    def snakes(self):
+        # living snakes by owner; without a robot player the index is built from the world on the first access
+        if self._snakes is None:
+            self._snakes = SnakeIndex()
+            self._snakes.load(self._world)
+
+        return self._snakes
+
+    @property
+    def me(self):
+        return self.snakes.get(self.owner, None)
+
     def next_direction(self, initial=False):
         raise NotImplementedError
 
@@ -30,21 +46,13 @@ class WallGrinderRobotSnake(RobotSnake):  # noqa: R701
         world = self.world
         # print(world)  # pretty print the world into the log file
 
-        head_position = [0, 0]
-        tail_position = [0, 0]
-
-        # lets find out our initial direction and length
-        for y in range(world.SIZE_Y):
-            for x in range(world.SIZE_X):
-                char, color = world[y][x]
+        me = self.me
 
-                if color == self.color:  # our snake
-                    if char == self.CH_TAIL:
-                        tail_position = [x, y]
-                    elif char == self.CH_HEAD:
-                        head_position = [x, y]
-                    elif char == self.CH_BODY:
-                        pass
+        if me and me.head and me.tail:
+            head_position = me.head
+            tail_position = me.tail
+        else:
+            head_position = tail_position = (0, 0)
 
         if initial:
             # noinspection PyAttributeOutsideInit
@@ -103,34 +111,20 @@ class WallGrinderRobotSnake(RobotSnake):  # noqa: R701
 
 class TailChasingRobotSnake(RobotSnake):  # noqa: R701
     def next_direction(self, initial=False):  # noqa: R701
-        world = self.world
-        # print(world)  # pretty print the world into the log file
+        # print(self.world)  # pretty print the world into the log file
 
         if initial:
             # noinspection PyAttributeOutsideInit
             self.current_direction = None
             # noinspection PyAttributeOutsideInit
-            self.length = 0
-            # noinspection PyAttributeOutsideInit
             self.changed_direction = False
+            me = self.me
 
-            head_position = [0, 0]
-            tail_position = [0, 0]
-
-            # lets find out our initial direction and length
-            for y in range(world.SIZE_Y):
-                for x in range(world.SIZE_X):
-                    char, color = world[y][x]
-
-                    if color == self.color:  # our snake
-                        if char == self.CH_TAIL:
-                            tail_position = [x, y]
-                        elif char == self.CH_HEAD:
-                            head_position = [x, y]
-                        elif char == self.CH_BODY:
-                            pass
-
-                        self.length += 1
+            if me and me.head and me.tail:
+                head_position = me.head
+                tail_position = me.tail
+            else:
+                head_position = tail_position = (0, 0)
 
             if head_position[0] > tail_position[0]:
                 self.current_direction = self.RIGHT
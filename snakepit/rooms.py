@@ -0,0 +1,97 @@
+import asyncio
+from time import monotonic
+from logging import getLogger
+
+from . import settings
+from .game import Game
+from .exceptions import TooManyRooms
+
+logger = getLogger(__name__)
+
+
+class Rooms:
+    """
+    Named game rooms created on demand and removed after being idle for some time.
+    """
+    DEFAULT_ROOM = settings.DEFAULT_ROOM
+
+    def __init__(self, max_rooms=settings.MAX_ROOMS, idle_timeout=settings.ROOM_IDLE_TIMEOUT, game_class=Game):
+        self.max_rooms = max_rooms
+        self.game_class = game_class
+        self.idle_timeout = idle_timeout
+        self._games = {}
+        self._idle_since = {}
+
+    def __repr__(self):
+        return '<%s [rooms=%s]>' % (self.__class__.__name__, len(self._games))
+
+    def __len__(self):
+        return len(self._games)
+
+    def __contains__(self, name):
+        return name in self._games
+
+    def __iter__(self):
+        return iter(self._games.values())
+
+    def get(self, name=DEFAULT_ROOM):
+        try:
+            return self._games[name]
+        except KeyError:
+            pass
+
+        if len(self._games) >= self.max_rooms:
+            raise TooManyRooms('Maximum number of rooms reached')
+
+        game = self._games[name] = self.game_class(name=name)
+        self._idle_since[name] = monotonic()
+        logger.info('Created new room %r', game)
+
+        return game
+
+    def load(self):
+        # load report of all rooms (see cluster.Matchmaker)
+        rooms = {}
+
+        for game in self._games.values():
+            stats = game.scheduler.stats()
+            rooms[game.name] = {
+                'players': game.players_count,
+                'alive': game.players_alive_count,
+                'spectators': game.spectators_count,
+                'frames': stats['frames'],
+                'overruns': stats['overruns'],
+            }
+
+        return {'max_rooms': self.max_rooms, 'rooms': rooms}
+
+    def is_idle(self, game):
+        return not game.running and not game.sessions and not game.players_count and not game.spectators_count
+
+    async def remove(self, name):
+        game = self._games.pop(name)
+        self._idle_since.pop(name, None)
+        logger.info('Removing room %r', game)
+        await game.shutdown()
+        game.metrics.remove()
+
+        if game.loop_task:
+            game.loop_task.cancel()
+
+    async def reap(self):
+        now = monotonic()
+
+        for name, game in list(self._games.items()):
+            if not self.is_idle(game):
+                self._idle_since.pop(name, None)
+            elif now - self._idle_since.setdefault(name, now) >= self.idle_timeout:
+                await self.remove(name)
+
+    async def reaper(self):
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            await self.reap()
+
+    async def shutdown(self):
+        for game in list(self._games.values()):
+            await game.shutdown()
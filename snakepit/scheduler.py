@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+from time import monotonic
+
+from . import settings
+
+
+class FrameScheduler:
+    """
+    Fixed-timestep frame scheduler based on monotonic clock deadlines.
+    """
+    POLICY_CATCH_UP = 'catch_up'  # render late frames back to back until the schedule is met again
+    POLICY_SKIP = 'skip'  # forget missed frame slots and continue from now
+    POLICIES = frozenset([POLICY_CATCH_UP, POLICY_SKIP])
+
+    STATS_SIZE = 256  # number of recent frames used for jitter and fps statistics
+
+    def __init__(self, speed, policy=settings.GAME_OVERRUN_POLICY, catch_up_max=settings.GAME_CATCH_UP_FRAMES_MAX,
+                 clock=monotonic):
+        self.period = 1.0 / speed
+        self.policy = policy
+        self.catch_up_max = catch_up_max
+        self.clock = clock
+        self.deadline = None
+        self.frames = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.overrun_max = 0.0
+        self.lateness = 0.0
+        self._jitter = deque(maxlen=self.STATS_SIZE)
+        self._starts = deque(maxlen=self.STATS_SIZE)
+
+    def __repr__(self):
+        return '<%s [period=%.4f] [policy=%s]>' % (self.__class__.__name__, self.period, self.policy)
+
+    def set_speed(self, speed):
+        self.period = 1.0 / speed
+
+    def start(self):
+        self.deadline = self.clock()
+        self._starts.clear()
+        self._starts.append(self.deadline)
+
+    async def wait(self):
+        # sleep until the next frame's deadline; the time spent rendering the last frame is already subtracted
+        if self.deadline is None:
+            self.start()
+
+        self.frames += 1
+        self.deadline += self.period
+        now = self.clock()
+        delay = self.deadline - now
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+            now = self.clock()
+        else:
+            lag = -delay
+            self.overruns += 1
+            self.overrun_max = max(self.overrun_max, lag)
+
+            if self.policy == self.POLICY_SKIP or lag > self.catch_up_max * self.period:
+                self.skipped += int(lag / self.period)
+                self.deadline = now
+
+            # let other tasks (websocket readers and writers, other games) run
+            await asyncio.sleep(0)
+
+        self.lateness = now - self.deadline
+        self._jitter.append(self.lateness)
+        self._starts.append(now)
+
+    @property
+    def fps(self):
+        if len(self._starts) < 2:
+            return 0.0
+
+        elapsed = self._starts[-1] - self._starts[0]
+
+        if elapsed <= 0:
+            return 0.0
+
+        return (len(self._starts) - 1) / elapsed
+
+    def stats(self):
+        jitter = self._jitter
+
+        return {
+            'frames': self.frames,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'overrun_max': self.overrun_max,
+            'jitter_mean': sum(jitter) / len(jitter) if jitter else 0.0,
+            'jitter_max': max(jitter, default=0.0),
+            'fps': self.fps,
+        }
@@ -1,3 +1,4 @@
+import os
 import asyncio
 
 try:
@@ -12,14 +13,30 @@ from logging import getLogger
 from aiohttp import web, WSMsgType
 
 from . import settings
-from .game import Game
-from .utils import get_client_address, validate_settings, validate_player_name, validate_player_id
+from .rooms import Rooms
+from .utils import (get_client_address, validate_settings, validate_player_name, validate_player_id,
+                    validate_room_name, validate_replay_name)
 from .messaging import json, Messaging
-from .exceptions import ValidationError
+from .replay import ReplayReader, RECORD_KEYFRAME
+from .metrics import REGISTRY
+from .exceptions import ValidationError, TooManyRooms
 
 logger = getLogger(__name__)
 
 
+def _get_protocol(data, index):
+    try:
+        protocol = data[index]
+    except IndexError:
+        protocol = Messaging.PROTOCOL_JSON
+    else:
+        if not isinstance(protocol, str) or protocol not in Messaging.PROTOCOLS:
+            logger.warning('Unsupported protocol "%s" requested - falling back to JSON', protocol)
+            protocol = Messaging.PROTOCOL_JSON
+
+    return protocol
+
+
 def _get_new_player_info(data):
     try:
         player_name = data[1]
@@ -38,69 +55,117 @@ def _get_new_player_info(data):
         else:
             player_id = None
 
-    return player_name, player_id
+    return player_name, player_id, _get_protocol(data, 3)
+
+
+class Session:
+    """
+    Player or spectator behind one client connection; client messages (except pings) are passed to handle().
+    """
+    def __init__(self, game, ws, client_address):
+        self.game = game
+        self.ws = ws
+        self.client_address = client_address
+        self.player = None
+        self.spectator = None
+        game.sessions += 1  # the room is not idle while the session is attached
+
+    def __repr__(self):
+        return '<%s [client=%s] [%r]>' % (self.__class__.__name__, self.client_address, self.player or self.spectator)
+
+    async def handle(self, data):
+        # returns False if the connection should be closed
+        game = self.game
+
+        # noinspection PyUnresolvedReferences
+        if isinstance(data, int) and self.player:
+            # Interpret as key code
+            self.player.keypress(data)
+        elif not isinstance(data, list) or not data:
+            logger.error('Invalid data from %s: %s', self.client_address, data)
+        elif data[0] == Messaging.MSG_NEW_PLAYER:
+            if not self.player and not self.spectator:
+                try:
+                    # noinspection PyTypeChecker
+                    player_name, player_id, protocol = _get_new_player_info(data)
+                except ValidationError as exc:
+                    logger.error('Invalid new player request: %r', exc)
+                    await self.ws.send_json([Messaging.MSG_ERROR, str(exc)])
+                    return False
+                else:
+                    self.player = await game.new_player(player_name, self.ws, player_id=player_id, protocol=protocol)
+                    logger.info('Connected %r to the game', self.player)
+        elif data[0] == Messaging.MSG_SPECTATE:
+            if not self.player and not self.spectator:
+                self.spectator = await game.new_spectator(self.ws, protocol=_get_protocol(data, 1))
+                logger.info('Connected spectator %r to the game', self.spectator)
+        elif data[0] == Messaging.MSG_JOIN:
+            if self.player:
+                if not game.running:
+                    # set before any await, so that joins handled in one burst do not start more game loops
+                    game.running = True
+                    await game.reset_world()
+                    logger.info('Starting game loop of %r by %r', game, self.player)
+
+                    try:
+                        game.loop_task = asyncio.ensure_future(game_loop(game))
+                    except asyncio.CancelledError:
+                        pass
+
+                await game.join(self.player)
+
+        return True
+
+    async def close(self):
+        self.game.sessions -= 1
+
+        if self.player:
+            await self.game.player_disconnected(self.player)
+
+        if self.spectator:
+            self.game.spectator_disconnected(self.spectator)
+
+        logger.info('Closed connection from %s: %r', self.client_address, self.player or self.spectator)
 
 
 async def ws_handler(request):
     client_address = get_client_address(request)
     logger.info('Connected to "%s" from %s', request.url, client_address)
-    game = request.app['game']
-    player = None
     ws = web.WebSocketResponse()
     await ws.prepare(request)
 
-    async for msg in ws:
-        if msg.type == WSMsgType.TEXT:
-            logger.debug('Got message from %s: %s', client_address, msg.data)
-
-            try:
-                data = json.loads(msg.data)
-            except ValueError:
-                logger.error('Invalid JSON data from %s: %s', client_address, msg.data)
-                continue
-
-            # noinspection PyUnresolvedReferences
-            if isinstance(data, int) and player:
-                # Interpret as key code
-                player.keypress(data)
-            elif not isinstance(data, list) or not data:
-                logger.error('Invalid data from %s: %s', client_address, data)
-                continue
-            elif data[0] == Messaging.MSG_PING:
-                await ws.send_json([Messaging.MSG_PONG] + data[1:], dumps=json.dumps)
-            elif data[0] == Messaging.MSG_NEW_PLAYER:
-                if not player:
-                    try:
-                        # noinspection PyTypeChecker
-                        player_name, player_id = _get_new_player_info(data)
-                    except ValidationError as exc:
-                        logger.error('Invalid new player request: %r', exc)
-                        await ws.send_json([Messaging.MSG_ERROR, str(exc)])
-                        break
-                    else:
-                        player = await game.new_player(player_name, ws, player_id=player_id)
-                        logger.info('Connected %r to the game', player)
-            elif data[0] == Messaging.MSG_JOIN:
-                if not game.running:
-                    await game.reset_world()
-                    logger.info('Starting game loop by %r', player)
-
-                    try:
-                        asyncio.ensure_future(game_loop(game))
-                    except asyncio.CancelledError:
-                        pass
-
-                await game.join(player)
+    try:
+        game = request.app['rooms'].get(validate_room_name(request.match_info.get('room', Rooms.DEFAULT_ROOM)))
+    except (ValidationError, TooManyRooms) as exc:
+        logger.error('Cannot connect %s to a room: %r', client_address, exc)
+        await ws.send_json([Messaging.MSG_ERROR, str(exc)])
+        await ws.close()
+        return ws
 
-        elif msg.type == WSMsgType.CLOSE:
-            break
-        else:
-            logger.warning('Unknown message type from %s: %s', client_address, msg.type)
+    session = Session(game, ws, client_address)
 
-    if player:
-        await game.player_disconnected(player)
+    try:
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                logger.debug('Got message from %s: %s', client_address, msg.data)
+
+                try:
+                    data = json.loads(msg.data)
+                except ValueError:
+                    logger.error('Invalid JSON data from %s: %s', client_address, msg.data)
+                    continue
+
+                if isinstance(data, list) and data and data[0] == Messaging.MSG_PING:
+                    await ws.send_json([Messaging.MSG_PONG] + data[1:], dumps=json.dumps)
+                elif not await session.handle(data):
+                    break
 
-    logger.info('Closed connection from %s: %r', client_address, player)
+            elif msg.type == WSMsgType.CLOSE:
+                break
+            else:
+                logger.warning('Unknown message type from %s: %s', client_address, msg.type)
+    finally:
+        await session.close()
 
     return ws
 
@@ -108,7 +173,7 @@ async def ws_handler(request):
 async def game_loop(game):
     server_shutdown = False
     game.running = True
-    game_sleep = 1.0 / game.speed
+    scheduler = game.scheduler
     game_speed_max = settings.GAME_SPEED_MAX
     game_speed_increase = settings.GAME_SPEED_INCREASE
     game_speed_increase_rate = settings.GAME_SPEED_INCREASE_RATE
@@ -125,6 +190,8 @@ async def game_loop(game):
 
             logger.info('All required (%d) players are here - 3, 2, 1, fight!', game.players_alive_count)
 
+        scheduler.start()
+
         while True:
             await game.next_frame()
 
@@ -144,9 +211,10 @@ async def game_loop(game):
             if (game_speed_increase and game_speed_increase <= game.frame and
                     (not game_speed_max or game.speed < game_speed_max)):
                 game.speed = round(game.speed + game.speed * game_speed_increase_rate, 6)
-                game_sleep = 1.0 / game.speed
+                scheduler.set_speed(game.speed)
 
-            await asyncio.sleep(game_sleep)
+            await scheduler.wait()
+            game.metrics.frame_lateness.observe(scheduler.lateness)
 
             await game.disconnect_closed()
     except BaseException as exc:
@@ -154,30 +222,145 @@ async def game_loop(game):
         raise
     finally:
         game.running = False
+        logger.info('Game loop statistics: %s', scheduler.stats())
 
     if server_shutdown:
-        import os
         import signal
         os.kill(os.getpid(), signal.SIGTERM)
 
 
+async def _replay_ws_reader(ws):
+    # process control frames and answer pings of the browser client
+    async for msg in ws:
+        if msg.type == WSMsgType.TEXT:
+            try:
+                data = json.loads(msg.data)
+            except ValueError:
+                continue
+
+            if isinstance(data, list) and data and data[0] == Messaging.MSG_PING:
+                await ws.send_json([Messaging.MSG_PONG] + data[1:], dumps=json.dumps)
+
+
+async def play_replay(ws, reader, start=0, speed=1.0):
+    # frames up to the start frame are sent at once (starting from the nearest keyframe), the rest is sent at the
+    # recorded game speed multiplied by speed
+    loop = asyncio.get_event_loop()
+    fps = settings.GAME_SPEED
+    deadline = None
+    await ws.send_json([[Messaging.MSG_RESET_WORLD]], dumps=json.dumps)
+
+    for record_type, seq, batches in reader.records(start):
+        if ws.closed:
+            break
+
+        if record_type == RECORD_KEYFRAME:
+            if seq > start:  # keyframes are used only for seeking
+                continue
+        elif seq > start:
+            if deadline is None:
+                deadline = loop.time()
+            else:
+                deadline += 1.0 / (fps * speed)
+                await asyncio.sleep(deadline - loop.time())
+
+        for batch in batches:
+            for msg in batch:
+                if msg[0] == Messaging.MSG_SYNC:
+                    fps = msg[2]
+
+            await ws.send_str(json.dumps(batch))
+
+
+async def replay_handler(request):
+    client_address = get_client_address(request)
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    try:
+        if not settings.REPLAY_DIR:
+            raise ValidationError('Replays are not enabled.')
+
+        name = validate_replay_name(request.match_info['name'])
+        start = int(request.query.get('frame', 0))
+        speed = float(request.query.get('speed', 1))
+
+        if start < 0 or speed <= 0:
+            raise ValidationError('Invalid replay frame or speed.')
+
+        reader = ReplayReader(os.path.join(settings.REPLAY_DIR, name))
+    except (ValueError, OSError) as exc:
+        logger.error('Cannot play replay to %s: %r', client_address, exc)
+        await ws.send_json([Messaging.MSG_ERROR, 'Cannot play replay'])
+        await ws.close()
+        return ws
+
+    logger.info('Playing %r to %s from frame %d at %gx speed', reader, client_address, start, speed)
+    ws_reader = asyncio.ensure_future(_replay_ws_reader(ws))
+
+    try:
+        await play_replay(ws, reader, start=start, speed=speed)
+    except ConnectionResetError:
+        logger.info('Replay connection from %s closed', client_address)
+    finally:
+        reader.close()
+        ws_reader.cancel()
+
+    await ws.close()
+
+    return ws
+
+
+async def metrics_handler(request):
+    for game in request.app['rooms']:
+        game.metrics.update(game)
+
+    return web.Response(body=REGISTRY.render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def load_handler(request):
+    return web.Response(text=json.dumps(request.app['rooms'].load()), content_type='application/json')
+
+
+async def on_startup(app):
+    app['rooms_reaper'] = asyncio.ensure_future(app['rooms'].reaper())
+
+
 async def on_shutdown(app):
     logger.warning('Server shutdown')
-    game = app.get('game', None)
+    rooms = app.get('rooms', None)
+
+    if rooms:
+        await rooms.shutdown()
+
+
+async def on_cleanup(app):
+    reaper = app.get('rooms_reaper', None)
+
+    if reaper:
+        reaper.cancel()
 
-    if game:
-        await game.shutdown()
 
+def run(host=settings.SERVER_HOST, port=settings.SERVER_PORT, debug=settings.DEBUG, workers=settings.SERVER_WORKERS):
+    if workers:
+        from .workers import run as run_workers
+        return run_workers(host=host, port=port, debug=debug, workers=workers)
 
-def run(host=settings.SERVER_HOST, port=settings.SERVER_PORT, debug=settings.DEBUG):
     validate_settings(settings)
 
     app = web.Application(debug=debug)
-    app['game'] = Game()
+    app['rooms'] = Rooms()
 
     app.router.add_route('GET', '/connect', ws_handler)
+    app.router.add_route('GET', '/connect/{room}', ws_handler)
+    app.router.add_route('GET', '/replay/{name}', replay_handler)
+    app.router.add_route('GET', '/metrics', metrics_handler)
+    app.router.add_route('GET', '/load', load_handler)
     app.router.add_static('/', settings.WEB_ROOT)
 
+    app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
 
     web.run_app(app, host=host, port=port)
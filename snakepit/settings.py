@@ -10,9 +10,39 @@ WEB_ROOT = os.path.join(PROJECT_DIR, 'html')
 SERVER_HOST = os.environ.get('SNAKEPIT_HOST', None)
 SERVER_PORT = int(os.environ.get('SNAKEPIT_PORT', 8111))
 SERVER_DEBUG = DEBUG
+# number of websocket I/O worker processes next to one game simulation process (0 = everything in one process)
+SERVER_WORKERS = int(os.environ.get('SNAKEPIT_SERVER_WORKERS', 0))
 
 TOP_SCORES_FILE_DEFAULT = os.path.join(PROJECT_DIR, 'var', 'run', 'top_scores.txt')
 TOP_SCORES_FILE = os.environ.get('SNAKEPIT_TOP_SCORES_FILE', TOP_SCORES_FILE_DEFAULT)
+TOP_SCORES_STORE_DELAY = float(os.environ.get('SNAKEPIT_TOP_SCORES_STORE_DELAY', 2))  # seconds to collect changes
+
+SEND_QUEUE_SIZE = int(os.environ.get('SNAKEPIT_SEND_QUEUE_SIZE', 16))  # max. queued outbound messages per connection
+SEND_QUEUE_POLICY = os.environ.get('SNAKEPIT_SEND_QUEUE_POLICY', 'coalesce')  # coalesce, drop_spectators, disconnect
+
+# interest management: players receive only the world changes inside a viewport around their snake (0 = disabled)
+VIEWPORT_SIZE_X = int(os.environ.get('SNAKEPIT_VIEWPORT_SIZE_X', 0))
+VIEWPORT_SIZE_Y = int(os.environ.get('SNAKEPIT_VIEWPORT_SIZE_Y', 0))
+MINIMAP_SCALE = int(os.environ.get('SNAKEPIT_MINIMAP_SCALE', 8))  # world cells per minimap block in each direction
+MINIMAP_INTERVAL = int(os.environ.get('SNAKEPIT_MINIMAP_INTERVAL', 6))  # frames between two minimap updates
+
+# cluster of game servers behind a matchmaker (see bin/run_cluster.py)
+CLUSTER_LOAD_INTERVAL = float(os.environ.get('SNAKEPIT_CLUSTER_LOAD_INTERVAL', 1))  # seconds between load reports
+CLUSTER_OVERRUN_RATE_MAX = float(os.environ.get('SNAKEPIT_CLUSTER_OVERRUN_RATE_MAX', 0.05))  # avoid busier servers
+CLUSTER_STICKY_PLAYERS_MAX = int(os.environ.get('SNAKEPIT_CLUSTER_STICKY_PLAYERS_MAX', 100000))  # known player IDs
+
+DEFAULT_ROOM = 'default'  # room used by the /connect URL
+MAX_ROOMS = int(os.environ.get('SNAKEPIT_MAX_ROOMS', 64))  # max. number of concurrent game rooms in one process
+ROOM_IDLE_TIMEOUT = float(os.environ.get('SNAKEPIT_ROOM_IDLE_TIMEOUT', 60))  # seconds before an empty room is removed
+
+GAME_OVERRUN_POLICY = os.environ.get('SNAKEPIT_GAME_OVERRUN_POLICY', 'catch_up')  # catch_up or skip late frames
+GAME_CATCH_UP_FRAMES_MAX = int(os.environ.get('SNAKEPIT_GAME_CATCH_UP_FRAMES_MAX', 3))  # skip when lagging more
+
+REPLAY_DIR = os.environ.get('SNAKEPIT_REPLAY_DIR', None)  # record all games into this directory (None = disabled)
+REPLAY_KEYFRAME_INTERVAL = int(os.environ.get('SNAKEPIT_REPLAY_KEYFRAME_INTERVAL', 100))  # full world every N frames
+
+# fraction of the frame interval for a robot's next_direction() running in a worker thread (0 = no deadline)
+ROBOT_DECISION_BUDGET = float(os.environ.get('SNAKEPIT_ROBOT_DECISION_BUDGET', 0))
 
 #
 # Logging
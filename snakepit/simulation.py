@@ -0,0 +1,185 @@
+import asyncio
+from time import perf_counter
+from logging import getLogger
+
+from .game import Game
+from .top_scores import TopScores
+from .messaging import Messaging
+from .robot_snake import RobotSnake
+from .snake_index import SnakeIndex
+from .utils import percentile
+
+logger = getLogger(__name__)
+
+
+class NullWebSocket:
+    """
+    WebSocket stand-in which accepts and forgets all messages.
+    """
+    closed = False
+    close_code = None
+
+    async def send_str(self, data):
+        pass
+
+    async def send_bytes(self, data):
+        pass
+
+    async def close(self, code=None, message=None):
+        self.closed = True
+        self.close_code = code
+
+
+class HeadlessGame(Game):
+    """
+    Game keeping a snake index up to date from its broadcasts - the same way robot players do it.
+    """
+    def __init__(self, *args, snakes=None, **kwargs):
+        super(HeadlessGame, self).__init__(*args, **kwargs)
+        self.snakes = snakes
+
+    async def _send_msg_all_multi(self, messages):
+        snakes = self.snakes
+
+        for msg in messages:
+            cmd = msg[0]
+
+            if cmd == self.MSG_RENDER:
+                snakes.update(msg[1], msg[2], msg[3], msg[4], msg[5])
+            elif cmd == self.MSG_RESET_WORLD:
+                snakes.clear()
+
+        await super(HeadlessGame, self)._send_msg_all_multi(messages)
+
+
+class HeadlessRobot:
+    """
+    In-process robot player: a game Player controlled by a RobotSnake reading the game's world directly.
+    """
+    keymap = {
+        RobotSnake.LEFT: Messaging.CMD_LEFT,
+        RobotSnake.UP: Messaging.CMD_UP,
+        RobotSnake.RIGHT: Messaging.CMD_RIGHT,
+        RobotSnake.DOWN: Messaging.CMD_DOWN,
+    }
+
+    def __init__(self, player, snake_class, snakes):
+        self.player = player
+        self.snake_class = snake_class
+        self.snakes = snakes
+        self.snake = None
+        self.started = False
+
+    def __repr__(self):
+        return '<%s [player=%r] [snake=%s]>' % (self.__class__.__name__, self.player, self.snake_class.__name__)
+
+    def born(self, game_settings, world):
+        if self.snake and self.started:
+            self.snake.game_over()
+
+        self.snake = self.snake_class(game_settings, world, self.player.color, owner=self.player.snake.owner)
+        self.snake._snakes = self.snakes
+        self.started = False
+
+    def tick(self):
+        player = self.player
+
+        if not player.alive:
+            if self.snake and self.started:
+                self.snake.game_over()
+                self.started = False
+
+            return
+
+        if not player.snake.body:  # not rendered yet
+            return
+
+        direction = self.snake.next_direction(initial=not self.started)
+        self.started = True
+        code = self.keymap.get(direction, None)
+
+        if code:
+            player.keypress(code)
+
+
+class Simulation:
+    """
+    Run a game with in-process robot players - no sockets and no sleeping.
+    """
+    def __init__(self, robot_classes, respawn=True, protocol=Messaging.PROTOCOL_JSON):
+        self.robot_classes = robot_classes
+        self.respawn = respawn
+        self.protocol = protocol
+        self.snakes = SnakeIndex()  # shared by all robots
+        self.game = HeadlessGame(name='simulation', top_scores=TopScores(None), snakes=self.snakes)  # no leaderboard
+        self.robots = []
+        self.frame_times = []
+        self.robot_times = []
+
+    def __repr__(self):
+        return '<%s [robots=%d] [frames=%d]>' % (self.__class__.__name__, len(self.robots), len(self.frame_times))
+
+    async def setup(self):
+        game = self.game
+        await game.reset_world()
+
+        for i, snake_class in enumerate(self.robot_classes):
+            player = await game.new_player('%s%d' % (snake_class.__name__[:12], i), NullWebSocket(),
+                                           protocol=self.protocol)
+            self.robots.append(HeadlessRobot(player, snake_class, self.snakes))
+
+        await self.join()
+
+    async def join(self):
+        game = self.game
+
+        for robot in self.robots:
+            if not robot.player.alive:
+                await game.join(robot.player)
+
+                if robot.player.alive:
+                    robot.born(game.settings, game.world)
+
+    async def next_frame(self):
+        start = perf_counter()
+
+        for robot in self.robots:
+            robot.tick()
+
+        self.robot_times.append(perf_counter() - start)
+
+        start = perf_counter()
+        await self.game.next_frame()
+        self.frame_times.append(perf_counter() - start)
+
+        if self.respawn or not self.game.players_alive_count:
+            await self.join()
+
+        # let the connection writers drain their queues
+        await asyncio.sleep(0)
+
+    async def run(self, frames):
+        logger.info('Running %r for %d frames', self, frames)
+        await self.setup()
+
+        for _ in range(frames):
+            await self.next_frame()
+
+        await self.game.shutdown()
+
+        return self.stats()
+
+    def stats(self):
+        frame_times = self.frame_times
+        total = sum(frame_times)
+
+        return {
+            'players': len(self.robots),
+            'frames': len(frame_times),
+            'fps': len(frame_times) / total if total else 0.0,
+            'frame_p50': percentile(frame_times, 50),
+            'frame_p90': percentile(frame_times, 90),
+            'frame_p99': percentile(frame_times, 99),
+            'frame_max': max(frame_times, default=0.0),
+            'robot_mean': sum(self.robot_times) / len(self.robot_times) if self.robot_times else 0.0,
+        }
@@ -1,12 +1,95 @@
-from collections import deque
+from array import array
 from random import randint
 
 from . import settings
-from .datatypes import Vector, Position, Draw
+from .datatypes import Vector, Position
 from .exceptions import SnakeError, SnakePlacementError
 from .world import World
 
 
+class SnakeBody:
+    """
+    Ring buffer of packed cell indices (y * World.SIZE_X + x) ordered from the head to the tail.
+
+    The buffer grows by doubling, so moving and growing does not allocate anything per segment. The head and tail
+    cell indices are cached.
+    """
+    __slots__ = ('_cells', '_start', '_length', 'head', 'tail')
+
+    def __init__(self, capacity=settings.INIT_LENGTH * 4):
+        self._cells = array('l', [-1]) * max(capacity, 1)
+        self._start = 0  # buffer position of the head
+        self._length = 0
+        self.head = self.tail = -1
+
+    def __repr__(self):
+        return '<%s [length=%d] [head=%d] [tail=%d]>' % (self.__class__.__name__, self._length, self.head, self.tail)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        # positions from the head to the tail
+        size_x = World.SIZE_X
+
+        for cell in self.cells():
+            yield Position(cell % size_x, cell // size_x)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+
+        if not 0 <= i < self._length:
+            raise IndexError('snake body index out of range')
+
+        cell = self._cells[(self._start + i) % len(self._cells)]
+
+        return Position(cell % World.SIZE_X, cell // World.SIZE_X)
+
+    def cells(self):
+        # cell indices from the head to the tail
+        cells = self._cells
+        start = self._start
+        end = start + self._length
+
+        if end <= len(cells):
+            return cells[start:end]
+
+        return cells[start:] + cells[:end - len(cells)]
+
+    def clear(self):
+        self._start = self._length = 0
+        self.head = self.tail = -1
+
+    def appendleft(self, cell):
+        # new head
+        cells = self._cells
+
+        if self._length == len(cells):
+            cells = self._cells = self.cells() + array('l', [-1]) * len(cells)
+            self._start = 0
+
+        self._start = start = (self._start - 1) % len(cells)
+        cells[start] = self.head = cell
+
+        if not self._length:
+            self.tail = cell
+
+        self._length += 1
+
+    def pop(self):
+        # remove the tail
+        cell = self.tail
+        self._length -= 1
+
+        if self._length:
+            self.tail = self._cells[(self._start + self._length - 1) % len(self._cells)]
+        else:
+            self.head = self.tail = -1
+
+        return cell
+
+
 class BaseSnake:
     COLOR_0 = World.COLOR_0
     CH_VOID = World.CH_VOID
@@ -30,16 +113,18 @@ class BaseSnake:
     DIRECTIONS = (UP, DOWN, LEFT, RIGHT)
 
     color = None
+    owner = 0
     alive = False
 
-    def __init__(self, game_settings, world, color):
+    def __init__(self, game_settings, world, color, owner=0):
         self._game_settings = game_settings
         self._world = world
         self.color = color
+        self.owner = owner  # player index stored in the world cells of this snake
         self.alive = True
 
     def __repr__(self):
-        return '<%s [color=%s]>' % (self.__class__.__name__, self.color)
+        return '<%s [color=%s] [owner=%s]>' % (self.__class__.__name__, self.color, self.owner)
 
 
 class Snake(BaseSnake):
@@ -50,7 +135,7 @@ class Snake(BaseSnake):
 
     def __init__(self, *args, **kwargs):
         super(Snake, self).__init__(*args, **kwargs)
-        self.body = deque()
+        self.body = SnakeBody()
         self.grew = False
 
     def reset(self):
@@ -58,7 +143,7 @@ class Snake(BaseSnake):
         self.body.clear()
         self.direction = self.current_direction = None
 
-    def create(self):
+    def create(self, diff):
         assert not self.grow
         assert not self.body
         assert not self.direction
@@ -68,60 +153,70 @@ class Snake(BaseSnake):
         x = randint(distance, World.SIZE_X - distance)
         y = randint(distance, World.SIZE_Y - distance)
         self.direction = self.current_direction = self.DIRECTIONS[randint(0, 3)]
+        step = self.direction.ydir * World.SIZE_X + self.direction.xdir
         # create snake from tail to head
-        render = []
-        pos = Position(x, y)
+        cells = range(y * World.SIZE_X + x, y * World.SIZE_X + x + settings.INIT_LENGTH * step, step)
+
+        for cell in cells:
+            # cells rendered earlier in this frame are not in the world yet
+            char = diff.get_char(cell)
 
-        for i in range(0, settings.INIT_LENGTH):
-            target = self._world[pos.y][pos.x]
+            if char is None:
+                char = self._world.get_char(cell)
 
-            if target.char != self.CH_VOID:
-                raise SnakePlacementError('Cannot place snake on %r because the position '
-                                          'is occupied by %r', pos, target)
+            if char != self.CH_VOID:
+                raise SnakePlacementError('Cannot place snake on %r because the position is occupied by %r' %
+                                          (Position(cell % World.SIZE_X, cell // World.SIZE_X), char))
 
-            if i == 0:
+        for cell in cells:
+            if cell == cells[0]:
                 char = self.CH_TAIL
-            elif i == settings.INIT_LENGTH - 1:
+            elif cell == cells[-1]:
                 char = self.CH_HEAD
             else:
                 char = self.CH_BODY
 
-            self.body.appendleft(pos)
-            render.append(Draw(pos.x, pos.y, char, self.color))
-            pos = self.next_position()
-
-        return render
-
-    def render_new(self):
-        render = None
+            self.body.appendleft(cell)
+            diff.set_cell(cell, char, self.color, self.owner)
 
+    def render_new(self, diff):
         for i in range(0, settings.INIT_RETRIES):
             try:
-                render = self.create()
+                self.create(diff)
             except SnakePlacementError:
                 self.reset()
             else:
-                break
+                return
 
-        if not render:
-            raise SnakeError('There is no place for a new snake in this world :(')
-
-        return render
+        raise SnakeError('There is no place for a new snake in this world :(')
 
     def next_position(self):
         # next position of the snake's head
-        return Position(self.body[0].x + self.direction.xdir,
-                        self.body[0].y + self.direction.ydir)
+        head = self.body.head
+
+        return Position(head % World.SIZE_X + self.direction.xdir, head // World.SIZE_X + self.direction.ydir)
+
+    def next_cell(self):
+        # cell index of the next position of the snake's head or -1 if it is outside of the world
+        y, x = divmod(self.body.head, World.SIZE_X)
+        x += self.direction.xdir
+        y += self.direction.ydir
+
+        if x < 0 or x >= World.SIZE_X or y < 0 or y >= World.SIZE_Y:
+            return -1
+
+        return y * World.SIZE_X + x
 
-    def render_move(self, ignore_tail=False):
+    def render_move(self, diff, ignore_tail=False):
         # moving snake to the next position
-        render = []
-        new_head = self.next_position()
-        self.body.appendleft(new_head)
+        body = self.body
+        old_head = body.head
+        new_head = old_head + self.direction.ydir * World.SIZE_X + self.direction.xdir
+        body.appendleft(new_head)
         # draw head in the next position
-        render.append(Draw(new_head.x, new_head.y, self.CH_HEAD, self.color))
+        diff.set_cell(new_head, self.CH_HEAD, self.color, self.owner)
         # draw body in the old place of head
-        render.append(Draw(self.body[1].x, self.body[1].y, self.CH_BODY, self.color))
+        diff.set_cell(old_head, self.CH_BODY, self.color, self.owner)
         # save current direction of the head
         self.current_direction = self.direction
 
@@ -132,24 +227,23 @@ class Snake(BaseSnake):
         else:
             self.grew = False
             # otherwise the tail moves
-            old_tail = self.body.pop()
+            old_tail = body.pop()
             if not ignore_tail:
-                render.append(Draw(old_tail.x, old_tail.y, self.CH_VOID, self.COLOR_0))
-            new_tail = self.body[-1]
-            render.append(Draw(new_tail.x, new_tail.y, self.CH_TAIL, self.color))
+                diff.set_cell(old_tail, self.CH_VOID, self.COLOR_0)
+            diff.set_cell(body.tail, self.CH_TAIL, self.color, self.owner)
 
-        return render
+    def render_game_over(self, diff):
+        # dead snake
+        body = self.body
 
-    def render_game_over(self):
-        render = []
+        if not body:
+            return
 
-        # dead snake
-        for i, pos in enumerate(self.body):
-            if i == 0:
-                render.append(Draw(pos.x, pos.y, self.CH_DEAD_HEAD, self.COLOR_0))
-            elif i == len(self.body) - 1:
-                render.append(Draw(pos.x, pos.y, self.CH_DEAD_TAIL, self.COLOR_0))
-            else:
-                render.append(Draw(pos.x, pos.y, self.CH_DEAD_BODY, self.COLOR_0))
+        ch_body = self.CH_DEAD_BODY
+        color = self.COLOR_0
+
+        for cell in body.cells():
+            diff.set_cell(cell, ch_body, color)
 
-        return render
+        diff.set_cell(body.tail, self.CH_DEAD_TAIL, color)
+        diff.set_cell(body.head, self.CH_DEAD_HEAD, color)
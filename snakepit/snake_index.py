@@ -0,0 +1,135 @@
+from collections.abc import Mapping, Set
+
+from .datatypes import Position
+from .snake import BaseSnake
+
+BODY_CHARS = BaseSnake.BODY_CHARS
+CH_HEAD = BaseSnake.CH_HEAD
+CH_TAIL = BaseSnake.CH_TAIL
+
+
+class CellSet(Set):
+    """
+    Read-only view of a set of positions.
+    """
+    __slots__ = ('_cells',)
+
+    def __init__(self, cells):
+        self._cells = cells
+
+    def __contains__(self, pos):
+        return pos in self._cells
+
+    def __iter__(self):
+        return iter(self._cells)
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, set(self._cells))
+
+
+class SnakeInfo:
+    """
+    Read-only information about one living snake in the world.
+    """
+    __slots__ = ('owner', 'color', '_head', '_tail', '_cells', '_view')
+
+    def __init__(self, owner, color):
+        self.owner = owner
+        self.color = color
+        self._head = None
+        self._tail = None
+        self._cells = set()
+        self._view = CellSet(self._cells)
+
+    def __repr__(self):
+        return '<%s [owner=%s] [color=%s] [head=%s] [tail=%s] [length=%d]>' % (
+            self.__class__.__name__, self.owner, self.color, self._head, self._tail, len(self._cells))
+
+    @property
+    def head(self):
+        return self._head
+
+    @property
+    def tail(self):
+        return self._tail
+
+    @property
+    def length(self):
+        return len(self._cells)
+
+    @property
+    def body(self):
+        return self._view
+
+
+class SnakeIndex(Mapping):
+    """
+    Head, tail and body cells of every living snake in the world indexed by owner (player index).
+
+    It is kept up to date incrementally from the rendered cells (see update()), so it does not need the world.
+    """
+    def __init__(self):
+        self._snakes = {}
+        self._owners = {}  # position -> owner of every indexed cell
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, list(self._snakes.values()))
+
+    def __getitem__(self, owner):
+        return self._snakes[owner]
+
+    def __iter__(self):
+        return iter(self._snakes)
+
+    def __len__(self):
+        return len(self._snakes)
+
+    def clear(self):
+        self._snakes.clear()
+        self._owners.clear()
+
+    def update(self, x, y, char, color, owner):
+        # called for every change of the cell at x, y (render message)
+        pos = Position(x, y)
+        old_owner = self._owners.pop(pos, None)
+
+        if old_owner is not None:
+            snake = self._snakes[old_owner]
+            snake._cells.discard(pos)
+
+            if snake._head == pos:
+                snake._head = None
+
+            if snake._tail == pos:
+                snake._tail = None
+
+            if not snake._cells:
+                del self._snakes[old_owner]
+
+        if char in BODY_CHARS:
+            snake = self._snakes.get(owner, None)
+
+            if not snake:
+                snake = self._snakes[owner] = SnakeInfo(owner, color)
+
+            snake._cells.add(pos)
+            self._owners[pos] = owner
+
+            if char == CH_HEAD:
+                snake._head = pos
+            elif char == CH_TAIL:
+                snake._tail = pos
+
+    def load(self, world):
+        # the world must track owners
+        self.clear()
+        size_x = world.SIZE_X
+
+        for i in range(size_x * world.SIZE_Y):
+            char = world.get_char(i)
+
+            if char in BODY_CHARS:
+                self.update(i % size_x, i // size_x, char, world.get_color(i), world.get_owner(i))
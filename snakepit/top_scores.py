@@ -0,0 +1,127 @@
+import os
+import asyncio
+from bisect import bisect_left, insort
+from tempfile import NamedTemporaryFile
+from logging import getLogger
+
+from . import settings
+from .messaging import json
+
+logger = getLogger(__name__)
+
+
+class TopScores:
+    """
+    Best score of each player name kept sorted incrementally and stored to a JSON file in the background.
+    """
+    def __init__(self, filename, size=settings.MAX_TOP_SCORES, store_delay=settings.TOP_SCORES_STORE_DELAY):
+        self.filename = filename
+        self.size = size
+        self.store_delay = store_delay
+        self._scores = {}  # name -> (-score, seq)
+        self._table = []  # sorted list of (-score, seq, name)
+        self._seq = 0
+        self._store_handle = None
+        self._store_future = None
+
+        if filename:
+            self._load()
+
+    def __repr__(self):
+        return '<%s [file=%s] [size=%d]>' % (self.__class__.__name__, self.filename, len(self._table))
+
+    def __len__(self):
+        return len(self._table)
+
+    def __iter__(self):
+        return ((name, -neg_score) for neg_score, _, name in self._table)
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as fp:
+                content = fp.read()
+        except FileNotFoundError:
+            content = None
+
+        if content:
+            for name, score in json.loads(content):
+                self.update(name, score)
+
+    def update(self, name, score):
+        # returns True if the table has changed
+        if not score:
+            return False
+
+        key = self._scores.get(name, None)
+
+        if key:
+            if score <= -key[0]:
+                return False
+
+            del self._table[bisect_left(self._table, key + (name,))]
+
+        # among equal scores the older record goes first
+        self._seq += 1
+        key = (-score, self._seq)
+
+        if len(self._table) >= self.size and key > self._table[-1][:2]:
+            return False
+
+        self._scores[name] = key
+        insort(self._table, key + (name,))
+
+        while len(self._table) > self.size:
+            del self._scores[self._table.pop()[2]]
+
+        return True
+
+    def _write(self, content):
+        # atomic replace: the file contains either the old or the new table
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+
+        with NamedTemporaryFile('w', dir=dirname, prefix='.top_scores', delete=False) as fp:
+            try:
+                fp.write(content)
+                fp.flush()
+                os.fsync(fp.fileno())
+            except BaseException:
+                os.unlink(fp.name)
+                raise
+
+        os.replace(fp.name, self.filename)
+
+    def _store(self):
+        self._store_handle = None
+
+        if self._store_future and not self._store_future.done():
+            # writes must not overlap, otherwise an older table could be written last
+            self.schedule_store()
+            return
+
+        content = json.dumps(list(self))
+        loop = asyncio.get_event_loop()
+        self._store_future = loop.run_in_executor(None, self._write, content)
+        self._store_future.add_done_callback(self._store_done)
+
+    def _store_done(self, future):
+        exc = future.exception()
+
+        if exc:
+            logger.error('Could not store top scores into %s: %r', self.filename, exc)
+
+    def schedule_store(self):
+        # debounce: all changes made within store_delay seconds are written at once
+        if self.filename and not self._store_handle:
+            self._store_handle = asyncio.get_event_loop().call_later(self.store_delay, self._store)
+
+    async def flush(self):
+        # the running write is finished first, so that the latest changes are written last
+        if self._store_future:
+            await asyncio.wait([self._store_future])
+
+        if self._store_handle:
+            self._store_handle.cancel()
+            self._store()
+
+        if self._store_future:
+            await asyncio.wait([self._store_future])
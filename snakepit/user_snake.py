@@ -28,21 +28,13 @@ class SteeringUserSnake(RobotSnake):
     current_direction = None
 
     def get_current_direction(self):
-        head_position = [0, 0]
-        tail_position = [0, 0]
-
-        # lets find out our direction
-        for y in range(self.world.SIZE_Y):
-            for x in range(self.world.SIZE_X):
-                char, color = self.world[y][x]
-
-                if color == self.color:  # our snake
-                    if char == self.CH_TAIL:
-                        tail_position = [x, y]
-                    elif char == self.CH_HEAD:
-                        head_position = [x, y]
-                    elif char == self.CH_BODY:
-                        pass
+        me = self.me
+
+        if me and me.head and me.tail:
+            head_position = me.head
+            tail_position = me.tail
+        else:
+            head_position = tail_position = (0, 0)
 
         if tail_position[0] == head_position[0]:
             if tail_position[1] > head_position[1]:
@@ -1,5 +1,12 @@
+import re
+
 from .exceptions import ImproperlyConfigured, ValidationError
 from .game import Game
+from .world import World
+from .connection import Connection
+from .scheduler import FrameScheduler
+
+ROOM_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
 
 
 def get_client_address(request):
@@ -11,9 +18,56 @@ def get_client_address(request):
         return peername
 
 
+def percentile(values, percent):
+    # nearest-rank percentile of an unsorted sequence
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+
+    return values[rank]
+
+
 def validate_settings(settings):
-    if settings.MAX_PLAYERS > settings.NUM_COLORS:
-        raise ImproperlyConfigured('Invalid MAX_PLAYERS (> NUM_COLORS)')
+    if not 1 <= settings.MAX_PLAYERS <= World.MAX_OWNER:
+        raise ImproperlyConfigured('Invalid MAX_PLAYERS (not between 1 and %d)' % World.MAX_OWNER)
+
+    if settings.SERVER_WORKERS < 0:
+        raise ImproperlyConfigured('Invalid SERVER_WORKERS (< 0)')
+
+    if settings.CLUSTER_LOAD_INTERVAL <= 0:
+        raise ImproperlyConfigured('Invalid CLUSTER_LOAD_INTERVAL (<= 0)')
+
+    if not 0 <= settings.CLUSTER_OVERRUN_RATE_MAX <= 1:
+        raise ImproperlyConfigured('Invalid CLUSTER_OVERRUN_RATE_MAX (not between 0 and 1)')
+
+    if settings.REPLAY_KEYFRAME_INTERVAL < 1:
+        raise ImproperlyConfigured('Invalid REPLAY_KEYFRAME_INTERVAL (< 1)')
+
+    if not 0 <= settings.ROBOT_DECISION_BUDGET <= 1:
+        raise ImproperlyConfigured('Invalid ROBOT_DECISION_BUDGET (not between 0 and 1)')
+
+    if settings.SEND_QUEUE_SIZE < 1:
+        raise ImproperlyConfigured('Invalid SEND_QUEUE_SIZE (< 1)')
+
+    if settings.SEND_QUEUE_POLICY not in Connection.POLICIES:
+        raise ImproperlyConfigured('Invalid SEND_QUEUE_POLICY (not one of: %s)' %
+                                   ', '.join(sorted(Connection.POLICIES)))
+
+    if settings.VIEWPORT_SIZE_X < 0 or settings.VIEWPORT_SIZE_Y < 0 or \
+            bool(settings.VIEWPORT_SIZE_X) != bool(settings.VIEWPORT_SIZE_Y):
+        raise ImproperlyConfigured('Invalid VIEWPORT_SIZE_X or VIEWPORT_SIZE_Y (both must be positive or 0)')
+
+    if settings.MINIMAP_SCALE < 1:
+        raise ImproperlyConfigured('Invalid MINIMAP_SCALE (< 1)')
+
+    if settings.MINIMAP_INTERVAL < 1:
+        raise ImproperlyConfigured('Invalid MINIMAP_INTERVAL (< 1)')
+
+    if settings.GAME_OVERRUN_POLICY not in FrameScheduler.POLICIES:
+        raise ImproperlyConfigured('Invalid GAME_OVERRUN_POLICY (not one of: %s)' %
+                                   ', '.join(sorted(FrameScheduler.POLICIES)))
 
     if settings.FIELD_SIZE_X < len(Game.GAME_OVER_TEXT):
         raise ImproperlyConfigured('Invalid FIELD_SIZE_X (< %d)' % len(Game.GAME_OVER_TEXT))
@@ -52,3 +106,27 @@ def validate_player_id(value):
         return validate_string(value, min_length=1, max_length=36)
     except ValueError:
         raise ValidationError('Invalid player ID.')
+
+
+def validate_room_name(value):
+    try:
+        value = validate_string(value, min_length=1, max_length=32)
+    except ValueError:
+        raise ValidationError('Invalid room name.')
+
+    if not ROOM_NAME_RE.match(value):
+        raise ValidationError('Invalid room name.')
+
+    return value
+
+
+def validate_replay_name(value):
+    try:
+        value = validate_string(value, min_length=1, max_length=64)
+    except ValueError:
+        raise ValidationError('Invalid replay name.')
+
+    if not ROOM_NAME_RE.match(value):  # replay names are derived from room names
+        raise ValidationError('Invalid replay name.')
+
+    return value
@@ -0,0 +1,128 @@
+from logging import getLogger
+
+from . import settings
+from .messaging import Messaging
+
+logger = getLogger(__name__)
+
+MINIMAP_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'  # one character per minimap block (0 = no living snake)
+
+
+class Viewports:
+    """
+    Interest management for large worlds: players receive only the cell changes inside a viewport around their
+    snake's head and a coarse minimap of the whole world.
+
+    Viewports are aligned to a grid of regions (half of the viewport in each direction) and they move only when the
+    head gets close to the viewport's edge. A player entering a new region receives a snapshot of its new viewport.
+    The cell changes of each broadcast are indexed by region, so collecting the changes of one viewport does not
+    depend on the size of the world.
+    """
+    def __init__(self, world, size_x, size_y, minimap_scale=settings.MINIMAP_SCALE):
+        self.world = world
+        self.size_x = min(size_x, world.SIZE_X)
+        self.size_y = min(size_y, world.SIZE_Y)
+        self.step_x = max(self.size_x // 2, 1)
+        self.step_y = max(self.size_y // 2, 1)
+        # head distance from the viewport's edge which moves the viewport
+        self.margin_x = self.step_x // 4
+        self.margin_y = self.step_y // 4
+        # the last viewport is aligned too, so it can stick out of the world
+        self.max_x = -(-(world.SIZE_X - self.size_x) // self.step_x) * self.step_x
+        self.max_y = -(-(world.SIZE_Y - self.size_y) // self.step_y) * self.step_y
+        self.minimap_scale = minimap_scale
+        self.minimap_size_x = -(-world.SIZE_X // minimap_scale)
+        self.minimap_size_y = -(-world.SIZE_Y // minimap_scale)
+        self.minimap = None  # last minimap message
+
+    def __repr__(self):
+        return '<%s [%sx%s]>' % (self.__class__.__name__, self.size_x, self.size_y)
+
+    @staticmethod
+    def _align(pos, step, max_pos):
+        # the position ends up in the middle half of an aligned viewport
+        return min(max(((pos + step // 2) // step - 1) * step, 0), max_pos)
+
+    def get_viewport(self, head=None, viewport=None):
+        # top left corner of the viewport following the head; without a head the viewport stays (or is centered)
+        if head is None:
+            if viewport is None:
+                return (self._align(self.world.SIZE_X // 2, self.step_x, self.max_x),
+                        self._align(self.world.SIZE_Y // 2, self.step_y, self.max_y))
+
+            return viewport
+
+        if viewport is not None:
+            x, y = viewport
+
+            if (x + self.margin_x <= head.x < x + self.size_x - self.margin_x and
+                    y + self.margin_y <= head.y < y + self.size_y - self.margin_y):
+                return viewport
+
+        return self._align(head.x, self.step_x, self.max_x), self._align(head.y, self.step_y, self.max_y)
+
+    def get_snapshot(self, viewport):
+        # the viewport message clears the client's world; only non-empty cells are rendered
+        x, y = viewport
+        width = min(self.size_x, self.world.SIZE_X - x)
+        height = min(self.size_y, self.world.SIZE_Y - y)
+        messages = [[Messaging.MSG_VIEWPORT, x, y, width, height]]
+        messages.extend([Messaging.MSG_RENDER, cell_x, cell_y, char, color, owner]
+                        for cell_x, cell_y, char, color, owner in self.world.get_cells(x, y, width, height))
+
+        return messages
+
+    def index(self, messages):
+        # render messages by region
+        step_x = self.step_x
+        step_y = self.step_y
+        regions = {}
+
+        for msg in messages:
+            if msg[0] == Messaging.MSG_RENDER:
+                key = (msg[1] // step_x, msg[2] // step_y)
+
+                if key in regions:
+                    regions[key].append(msg)
+                else:
+                    regions[key] = [msg]
+
+        return regions
+
+    def get_renders(self, regions, viewport):
+        # render messages inside the viewport; the order of changes of each cell is kept
+        renders = []
+
+        if not regions:
+            return renders
+
+        x, y = viewport
+        x_end = x + self.size_x
+        y_end = y + self.size_y
+
+        for region_y in range(y // self.step_y, (y_end - 1) // self.step_y + 1):
+            for region_x in range(x // self.step_x, (x_end - 1) // self.step_x + 1):
+                for msg in regions.get((region_x, region_y), ()):
+                    if x <= msg[1] < x_end and y <= msg[2] < y_end:
+                        renders.append(msg)
+
+        return renders
+
+    def update_minimap(self, players):
+        # color of a living snake in every block of minimap_scale x minimap_scale world cells
+        scale = self.minimap_scale
+        size_x = self.minimap_size_x
+        world_size_x = self.world.SIZE_X
+        blocks = bytearray(b'0') * (size_x * self.minimap_size_y)
+
+        for player in players:
+            if player.alive:
+                digit = ord(MINIMAP_DIGITS[min(player.color, len(MINIMAP_DIGITS) - 1)])
+
+                for cell in player.snake.body.cells():
+                    blocks[cell // world_size_x // scale * size_x + cell % world_size_x // scale] = digit
+
+        text = blocks.decode('ascii')
+        self.minimap = [Messaging.MSG_MINIMAP, scale, [text[i:i + size_x] for i in range(0, len(text), size_x)]]
+
+        return self.minimap
@@ -0,0 +1,489 @@
+import os
+import signal
+import socket
+import pickle
+import asyncio
+from itertools import count
+from collections import deque
+from struct import Struct
+from logging import getLogger
+from multiprocessing import Process
+from multiprocessing.connection import wait
+from aiohttp import web, WSMsgType
+
+from . import settings
+from .game import Game
+from .rooms import Rooms
+from .connection import Connection
+from .server import Session, replay_handler
+from .utils import get_client_address, validate_settings, validate_room_name
+from .messaging import json, Messaging
+from .metrics import REGISTRY
+from .exceptions import ValidationError, TooManyRooms
+
+logger = getLogger(__name__)
+
+# I/O worker -> simulation
+CMD_CONNECT = 'connect'  # conn_id, room, client_address
+CMD_DATA = 'data'  # conn_id, client message
+CMD_CLOSED = 'closed'  # conn_id, close_code
+CMD_METRICS = 'metrics'  # request for metrics of all rooms (the simulation answers with the same command)
+CMD_LOAD = 'load'  # request for the load report of all rooms (the simulation answers with the same command)
+# simulation -> I/O worker
+CMD_OPEN = 'open'  # conn_id, protocol, spectator
+CMD_SEND = 'send'  # list of (payload, [conn_id, ...])
+CMD_CLOSE = 'close'  # conn_id, code, message
+
+
+class Channel:
+    """
+    Commands (tuples) pickled into length-prefixed frames over a local stream socket.
+    """
+    HEADER = Struct('!I')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._reader = None
+        self._writer = None
+
+    def __repr__(self):
+        return '<%s [fd=%s]>' % (self.__class__.__name__, self.sock.fileno())
+
+    async def open(self):
+        self._reader, self._writer = await asyncio.open_connection(sock=self.sock)
+
+    def post(self, *cmd):
+        data = pickle.dumps(cmd, pickle.HIGHEST_PROTOCOL)
+        self._writer.write(self.HEADER.pack(len(data)) + data)
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def receive(self):
+        # next command or None if the other side is gone
+        try:
+            header = await self._reader.readexactly(self.HEADER.size)
+            return pickle.loads(await self._reader.readexactly(self.HEADER.unpack(header)[0]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+
+class RemoteSocket:
+    """
+    Websocket owned by an I/O worker as seen by the simulation process.
+    """
+    def __init__(self, link, conn_id):
+        self.link = link
+        self.conn_id = conn_id
+        self.closed = False
+        self.close_code = None
+
+    def __repr__(self):
+        return '<%s [id=%s]>' % (self.__class__.__name__, self.conn_id)
+
+    async def send_json(self, data, dumps=json.dumps):
+        self.link.send(self.conn_id, dumps(data))
+
+    async def close(self, code=Messaging.WSCloseCode.GOING_AWAY, message='Closing connection'):
+        if not self.closed:
+            self.closed = True
+            self.link.post(CMD_CLOSE, self.conn_id, code, message)
+
+
+class RemoteConnection(Connection):
+    """
+    Connection of a player or spectator in the simulation process. Payloads are forwarded to the I/O worker owning
+    the websocket, which keeps the send queue (see Connection).
+    """
+    # noinspection PyMissingConstructor
+    def __init__(self, ws, protocol=Messaging.PROTOCOL_JSON, spectator=False):
+        self.ws = ws
+        self.protocol = protocol
+        self.spectator = spectator
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._lagging = False
+        self._queue = ()
+        ws.link.post(CMD_OPEN, ws.conn_id, protocol, spectator)
+
+    def send(self, messages, payload=None):
+        if self.closed:
+            return
+
+        if payload is None:
+            payload = self.encode(messages)
+
+        self.ws.link.send(self.ws.conn_id, payload)
+        self.sent += 1
+
+    def shutdown(self):
+        pass
+
+
+class SimulationGame(Game):
+    connection_class = RemoteConnection
+
+    async def next_frame(self):
+        await super().next_frame()
+
+        # backpressure: the frame is not over while an I/O worker is behind with reading its payloads
+        links = {ws.ws.link for player in self._players.values() for ws in player.wss}
+        links.update(ws.ws.link for spectators in self._spectators.values() for ws in spectators)
+
+        for link in links:
+            await link.drain()
+
+
+class WorkerLink:
+    """
+    Simulation's end of the channel to one I/O worker.
+
+    A payload sent to many connections during one event loop iteration (e.g. a frame broadcast) crosses the process
+    boundary only once together with the IDs of all its receivers.
+    """
+    def __init__(self, channel, rooms):
+        self.channel = channel
+        self.rooms = rooms
+        self._sessions = {}  # conn_id -> Session
+        self._entries = []  # (payload, [conn_id, ...]) waiting to be sent
+        self._index = {}  # id(payload) -> position in entries
+        self._last = {}  # conn_id -> position of its last entry (payloads of one connection must stay in order)
+        self._flush_handle = None
+
+    def __repr__(self):
+        return '<%s [connections=%d]>' % (self.__class__.__name__, len(self._sessions))
+
+    def send(self, conn_id, payload):
+        index = self._index.get(id(payload), None)
+
+        if index is None or index < self._last.get(conn_id, -1):
+            index = self._index[id(payload)] = len(self._entries)
+            self._entries.append((payload, []))
+
+        self._entries[index][1].append(conn_id)
+        self._last[conn_id] = index
+
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._entries:
+            self.channel.post(CMD_SEND, self._entries)
+            self._entries = []
+            self._index.clear()
+            self._last.clear()
+
+    async def drain(self):
+        # waits until the channel's write buffer is below its high-water mark
+        self.flush()
+        await self.channel.drain()
+
+    def post(self, *cmd):
+        # other commands must not overtake payloads sent before them
+        self.flush()
+        self.channel.post(*cmd)
+
+    async def _connect(self, conn_id, room, client_address):
+        ws = RemoteSocket(self, conn_id)
+
+        try:
+            game = self.rooms.get(validate_room_name(room))
+        except (ValidationError, TooManyRooms) as exc:
+            logger.error('Cannot connect %s to a room: %r', client_address, exc)
+            await ws.send_json([Messaging.MSG_ERROR, str(exc)])
+            await ws.close()
+        else:
+            self._sessions[conn_id] = Session(game, ws, client_address)
+
+    async def _disconnect(self, conn_id, close_code=None):
+        session = self._sessions.pop(conn_id, None)
+
+        if session:
+            session.ws.closed = True
+            session.ws.close_code = close_code
+            await session.close()
+
+    async def _handle(self, cmd):
+        name = cmd[0]
+
+        if name == CMD_DATA:
+            session = self._sessions.get(cmd[1], None)
+
+            if session and not await session.handle(cmd[2]):
+                await session.ws.close()
+        elif name == CMD_CONNECT:
+            await self._connect(*cmd[1:])
+        elif name == CMD_CLOSED:
+            await self._disconnect(*cmd[1:])
+        elif name == CMD_METRICS:
+            for game in self.rooms:
+                game.metrics.update(game)
+
+            self.post(CMD_METRICS, REGISTRY.render())
+        elif name == CMD_LOAD:
+            self.post(CMD_LOAD, self.rooms.load())
+        else:
+            logger.warning('Unknown command from I/O worker: %s', cmd)
+
+    async def serve(self):
+        while True:
+            cmd = await self.channel.receive()
+
+            if cmd is None:
+                break
+
+            try:
+                await self._handle(cmd)
+            except Exception as exc:
+                logger.exception('Command %s failed: %r', cmd[0], exc)
+
+        logger.warning('I/O worker is gone - closing its %d connection(s)', len(self._sessions))
+
+        for conn_id in list(self._sessions):
+            await self._disconnect(conn_id)
+
+
+class IOWorker:
+    """
+    Websocket connections of one I/O worker process. Client messages are forwarded to the simulation process and
+    encoded payloads coming from the simulation are fanned out to the connections.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self._ids = count(1)
+        self._connections = {}  # conn_id -> Connection
+        self._requests = deque()  # futures waiting for answers from the simulation (answers come in order)
+
+    def __repr__(self):
+        return '<%s [pid=%s] [connections=%d]>' % (self.__class__.__name__, os.getpid(), len(self._connections))
+
+    async def ws_handler(self, request):
+        client_address = get_client_address(request)
+        logger.info('Connected to "%s" from %s', request.url, client_address)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        conn_id = next(self._ids)
+        # the protocol and role of the connection are decided by the simulation (see CMD_OPEN)
+        self._connections[conn_id] = Connection(ws)
+        self.channel.post(CMD_CONNECT, conn_id, request.match_info.get('room', settings.DEFAULT_ROOM), client_address)
+
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    logger.debug('Got message from %s: %s', client_address, msg.data)
+
+                    try:
+                        data = json.loads(msg.data)
+                    except ValueError:
+                        logger.error('Invalid JSON data from %s: %s', client_address, msg.data)
+                        continue
+
+                    if isinstance(data, list) and data and data[0] == Messaging.MSG_PING:
+                        await ws.send_json([Messaging.MSG_PONG] + data[1:], dumps=json.dumps)
+                    else:
+                        self.channel.post(CMD_DATA, conn_id, data)
+
+                elif msg.type == WSMsgType.CLOSE:
+                    break
+                else:
+                    logger.warning('Unknown message type from %s: %s', client_address, msg.type)
+        finally:
+            self._connections.pop(conn_id).shutdown()
+            self.channel.post(CMD_CLOSED, conn_id, ws.close_code)
+            logger.info('Closed connection from %s', client_address)
+
+        return ws
+
+    async def _request(self, cmd):
+        future = asyncio.get_event_loop().create_future()
+        self._requests.append(future)
+        self.channel.post(cmd)
+
+        return await future
+
+    async def metrics_handler(self, request):
+        return web.Response(body=(await self._request(CMD_METRICS)).encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def load_handler(self, request):
+        return web.Response(text=json.dumps(await self._request(CMD_LOAD)), content_type='application/json')
+
+    @staticmethod
+    async def _close(connection, code, message):
+        # queued messages (e.g. an error) are sent before closing
+        while connection.queue_depth and not connection.closed:
+            await asyncio.sleep(0.01)
+
+        await connection.close(code=code, message=message)
+
+    def _handle(self, cmd):
+        name = cmd[0]
+
+        if name == CMD_SEND:
+            connections = self._connections
+
+            for payload, conn_ids in cmd[1]:
+                for conn_id in conn_ids:
+                    connection = connections.get(conn_id, None)
+
+                    if connection:
+                        connection.send(None, payload)
+        elif name == CMD_OPEN:
+            connection = self._connections.get(cmd[1], None)
+
+            if connection:
+                connection.protocol = cmd[2]
+                connection.spectator = cmd[3]
+        elif name == CMD_CLOSE:
+            connection = self._connections.get(cmd[1], None)
+
+            if connection:
+                asyncio.ensure_future(self._close(connection, cmd[2], cmd[3]))
+        elif name in (CMD_METRICS, CMD_LOAD):
+            if self._requests:
+                self._requests.popleft().set_result(cmd[1])
+        else:
+            logger.warning('Unknown command from simulation: %s', cmd)
+
+    async def serve(self):
+        while True:
+            cmd = await self.channel.receive()
+
+            if cmd is None:
+                break
+
+            self._handle(cmd)
+
+        logger.error('Simulation process is gone - stopping %r', self)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    async def shutdown(self):
+        for connection in list(self._connections.values()):
+            await connection.close(code=Messaging.WSCloseCode.GOING_AWAY, message='Server shutdown')
+
+
+def _close_sockets(socks):
+    # with the fork start method children inherit all channel sockets; only their own ends must stay open, otherwise
+    # the other side would never see the channel closed
+    for sock in socks:
+        sock.close()
+
+
+def _run_simulation(socks, unused):
+    _close_sockets(unused)
+    loop = asyncio.get_event_loop()
+    rooms = Rooms(game_class=SimulationGame)
+
+    async def simulation():
+        links = []
+
+        for sock in socks:
+            channel = Channel(sock)
+            await channel.open()
+            links.append(WorkerLink(channel, rooms))
+
+        reaper = asyncio.ensure_future(rooms.reaper())
+        logger.info('Simulation process %s is serving %d I/O worker(s)', os.getpid(), len(links))
+
+        try:
+            await asyncio.gather(*(link.serve() for link in links))
+        finally:
+            reaper.cancel()
+            await rooms.shutdown()
+
+            for link in links:
+                await link.drain()
+
+    task = asyncio.ensure_future(simulation())
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    loop.add_signal_handler(signal.SIGINT, task.cancel)
+
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        logger.warning('Simulation process shutdown')
+
+
+def _run_io_worker(listen_sock, sock, unused, debug):
+    _close_sockets(unused)
+    worker = IOWorker(Channel(sock))
+
+    async def on_startup(app):
+        await worker.channel.open()
+        app['io_worker_task'] = asyncio.ensure_future(worker.serve())
+
+    async def on_shutdown(app):
+        logger.warning('I/O worker shutdown')
+        await worker.shutdown()
+
+    async def on_cleanup(app):
+        app['io_worker_task'].cancel()
+
+    app = web.Application(debug=debug)
+    app.router.add_route('GET', '/connect', worker.ws_handler)
+    app.router.add_route('GET', '/connect/{room}', worker.ws_handler)
+    app.router.add_route('GET', '/replay/{name}', replay_handler)
+    app.router.add_route('GET', '/metrics', worker.metrics_handler)
+    app.router.add_route('GET', '/load', worker.load_handler)
+    app.router.add_static('/', settings.WEB_ROOT)
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
+
+    web.run_app(app, sock=listen_sock, print=None)
+
+
+def _exit(signum, frame):
+    raise SystemExit('Terminated by signal %d' % signum)
+
+
+def run(host=settings.SERVER_HOST, port=settings.SERVER_PORT, debug=settings.DEBUG, workers=settings.SERVER_WORKERS):
+    """
+    Run all games in one simulation process and accept websocket connections in a number of I/O worker processes
+    sharing one listening socket. Workers forward client messages to the simulation, which sends every encoded
+    payload to each worker only once; the fan-out to sockets (and per-connection send queues) is done by the workers.
+    """
+    validate_settings(settings)
+
+    listen_sock = socket.socket(socket.AF_INET6 if host and ':' in host else socket.AF_INET)
+    listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_sock.bind((host or '', port))
+    listen_sock.listen(1024)
+    listen_sock.set_inheritable(True)
+
+    pairs = [socket.socketpair() for _ in range(workers)]
+    simulation_socks = [pair[0] for pair in pairs]
+    worker_socks = [pair[1] for pair in pairs]
+    processes = [Process(target=_run_simulation, args=(simulation_socks, worker_socks), name='snakepit-simulation')]
+
+    for i, sock in enumerate(worker_socks):
+        unused = simulation_socks + [s for s in worker_socks if s is not sock]
+        processes.append(Process(target=_run_io_worker, args=(listen_sock, sock, unused, debug),
+                                 name='snakepit-io-%d' % i))
+
+    for process in processes:
+        process.start()
+
+    signal.signal(signal.SIGTERM, _exit)
+    _close_sockets(simulation_socks + worker_socks)
+    listen_sock.close()
+    logger.info('Serving on %s:%s with %d I/O worker(s)', host or '*', port, workers)
+
+    try:
+        # any process exiting stops the whole server
+        wait([process.sentinel for process in processes])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+        for process in processes:
+            process.join()
@@ -1,19 +1,134 @@
+from array import array
+from random import randrange
+
 from . import settings
-from .datatypes import Char
+from .datatypes import Char, Position
+
+
+class FreeCells:
+    """
+    Indexable set of free cell indexes with O(1) add, discard and random choice.
+    """
+    __slots__ = ('_size', '_cells', '_positions')
+
+    def __init__(self, size):
+        self._size = size
+        self.reset()
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __contains__(self, i):
+        return self._positions[i] >= 0
+
+    def reset(self):
+        self._cells = array('l', range(self._size))
+        self._positions = array('l', range(self._size))
+
+    def clear(self):
+        self._cells = array('l')
+        self._positions = array('l', [-1]) * self._size
+
+    def add(self, i):
+        if self._positions[i] < 0:
+            self._positions[i] = len(self._cells)
+            self._cells.append(i)
+
+    def discard(self, i):
+        pos = self._positions[i]
+
+        if pos >= 0:
+            last = self._cells.pop()
+
+            if last != i:
+                self._cells[pos] = last
+                self._positions[last] = pos
+
+            self._positions[i] = -1
+
+    def choice(self):
+        if self._cells:
+            return self._cells[randrange(len(self._cells))]
+
+        return None
+
+
+class WorldRow:
+    """
+    A lightweight view of one row of the world supporting the world[y][x] indexing API.
+    """
+    __slots__ = ('_world', '_offset')
+
+    def __init__(self, world, y):
+        self._world = world
+        self._offset = y * world.SIZE_X
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, list(self))
+
+    def __len__(self):
+        return self._world.SIZE_X
+
+    def __iter__(self):
+        world = self._world
+
+        for i in range(self._offset, self._offset + world.SIZE_X):
+            yield world.get_cell(i)
+
+    def _index(self, x):
+        size_x = self._world.SIZE_X
+
+        if x < 0:
+            x += size_x
+
+        if x < 0 or x >= size_x:
+            raise IndexError('world row index out of range')
+
+        return self._offset + x
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return [self[i] for i in range(*x.indices(self._world.SIZE_X))]
+
+        return self._world.get_cell(self._index(x))
+
+    def __setitem__(self, x, value):
+        self._world.set_cell(self._index(x), value[0], value[1])
 
 
-class World(list):
+class World:
+    """
+    Game field stored in two flat typed arrays (characters and colors).
+
+    The world[y][x] indexing API returns and accepts Char tuples.
+    """
     SIZE_X = settings.FIELD_SIZE_X
     SIZE_Y = settings.FIELD_SIZE_Y
     COLOR_0 = 0
     CH_VOID = ' '
     CH_STONE = '#'
     VOID_CHAR = Char(CH_VOID, COLOR_0)
+    ORD_VOID = ord(CH_VOID)
+    MAX_OWNER = 0xFFFF  # owners are stored as unsigned shorts
+
+    def __init__(self, track_free_cells=False, track_owners=False):
+        size = self.SIZE_X * self.SIZE_Y
+        self._void_chars = bytes([self.ORD_VOID]) * size
+        self._void_colors = array('H', [self.COLOR_0]) * size
+        self._chars = bytearray(self._void_chars)
+        self._colors = array('H', self._void_colors)
+        self._rows = tuple(WorldRow(self, y) for y in range(self.SIZE_Y))
 
-    def __init__(self):
-        super(World, self).__init__()
-        for y in range(0, self.SIZE_Y):
-            self.append([self.VOID_CHAR] * self.SIZE_X)
+        if track_free_cells:
+            self._free_cells = FreeCells(size)
+        else:
+            self._free_cells = None
+
+        # player index of every living snake's cell; unlike colors, it is unique for each snake
+        if track_owners:
+            self._owners = array('H', self._void_colors)
+        else:
+            self._owners = None
 
     def __repr__(self):
         return '<%s [%sx%s]>' % (self.__class__.__name__, self.SIZE_X, self.SIZE_Y)
@@ -21,21 +136,125 @@ class World(list):
     def __str__(self):
         return self.show()
 
+    def __len__(self):
+        return self.SIZE_Y
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __getitem__(self, y):
+        return self._rows[y]
+
+    def get_cell(self, i):
+        return Char(chr(self._chars[i]), self._colors[i])
+
+    def get_char(self, i):
+        return chr(self._chars[i])
+
+    def get_color(self, i):
+        return self._colors[i]
+
+    def get_owner(self, i):
+        return self._owners[i]
+
+    def set_cell(self, i, char, color, owner=0):
+        ch = self._chars[i] = ord(char)
+        self._colors[i] = color
+
+        if self._owners is not None:
+            self._owners[i] = owner
+
+        if self._free_cells is not None:
+            if ch == self.ORD_VOID:
+                self._free_cells.add(i)
+            else:
+                self._free_cells.discard(i)
+
     def show(self):
-        border = '+' + '-' * len(self[0]) + '+'
-        return border + '\n' + '\n'.join('|' + (''.join(j[0] for j in i)) + '|' for i in self) + '\n' + border
+        size_x = self.SIZE_X
+        text = self._chars.decode('ascii')
+        border = '+' + '-' * size_x + '+'
+        rows = ('|' + text[i:i + size_x] + '|' for i in range(0, len(text), size_x))
+
+        return border + '\n' + '\n'.join(rows) + '\n' + border
 
     def reset(self):
-        for y in range(0, self.SIZE_Y):
-            for x in range(0, self.SIZE_X):
-                if self[y][x][0] != self.CH_VOID:
-                    self[y][x] = self.VOID_CHAR
+        self._chars[:] = self._void_chars
+        self._colors[:] = self._void_colors
+
+        if self._owners is not None:
+            self._owners[:] = self._void_colors
+
+        if self._free_cells is not None:
+            self._free_cells.reset()
 
     def load(self, data):
-        self[:] = data
+        i = 0
+
+        if self._free_cells is not None:
+            self._free_cells.clear()
+
+        for row in data:
+            for cell in row:  # char, color and optionally owner
+                self.set_cell(i, *cell)
+                i += 1
+
+    def dump(self):
+        # raw copy of the world (cheap; see restore())
+        return bytes(self._chars), self._colors.tobytes()
+
+    def restore(self, chars, colors):
+        # owners are not part of the copy
+        self._chars[:] = chars
+        self._colors[:] = array('H', colors)
+
+        if self._owners is not None:
+            self._owners[:] = self._void_colors
+
+        if self._free_cells is not None:
+            self._free_cells.clear()
+
+            for i, ch in enumerate(self._chars):
+                if ch == self.ORD_VOID:
+                    self._free_cells.add(i)
+
+    def snapshot(self):
+        # rows of [char, color, owner] cells (owner is 0 if owners are not tracked)
+        chars = self._chars.decode('ascii')
+        colors = self._colors
+        owners = self._owners or self._void_colors
+        size_x = self.SIZE_X
+
+        return [[[chars[i], colors[i], owners[i]] for i in range(offset, offset + size_x)]
+                for offset in range(0, len(chars), size_x)]
+
+    def get_cells(self, x, y, width, height):
+        # (x, y, char, color, owner) of all non-empty cells in a part of the world
+        chars = self._chars
+        colors = self._colors
+        owners = self._owners or self._void_colors
+        size_x = self.SIZE_X
+        width = min(width, size_x - x)
+        void = self.ORD_VOID
+        cells = []
+
+        for row_y in range(y, min(y + height, self.SIZE_Y)):
+            offset = row_y * size_x + x
+
+            for n, ch in enumerate(chars[offset:offset + width]):
+                if ch != void:
+                    cells.append((x + n, row_y, chr(ch), colors[offset + n], owners[offset + n]))
+
+        return cells
+
+    def random_free_position(self):
+        # return a uniformly random empty position or None if the world is full
+        i = self._free_cells.choice()
+
+        if i is None:
+            return None
 
-    def update(self, draw):
-        self[draw.y][draw.x] = Char(draw.char, draw.color)
+        return Position(i % self.SIZE_X, i // self.SIZE_X)
 
     @classmethod
     def is_invalid_position(cls, pos):